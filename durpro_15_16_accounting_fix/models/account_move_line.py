@@ -1,18 +1,30 @@
 from odoo import models, fields, api, _, Command
 from odoo.exceptions import ValidationError
 import logging
-from typing import List, Set, Tuple
-from psycopg2.errors import UniqueViolation
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from psycopg2.errors import SerializationFailure, UniqueViolation
 import re
 
+from ..staging import copy_rows
+
 _logger = logging.getLogger(__name__)
 
+# Number of journal entries fixed per chunk (and transaction) by default
+MOVE_CHUNK_SIZE = 10000
+
+# Number of chunks fixed at the same time by default, each with a database connection of its own
+FIX_WORKERS = 4
+
+# Lines in this currency must have an amount_currency equal to their balance
+COMPANY_CURRENCY_ID = 4
+
 
 class AccountMoveLine(models.Model):
     _inherit = 'account.move.line'
 
     @api.model
-    def fix(self):
+    def fix(self, chunk_size=MOVE_CHUNK_SIZE, workers=FIX_WORKERS):
         """
         The following account.payment entries are problematic for migration:
             * Have more than 1 currency in the lines
@@ -30,56 +42,190 @@ class AccountMoveLine(models.Model):
             The idea is that if we grab any lines that have account types of 'payable', 'receivable' or 'liquidity' and
             make sure that there are no more than one line per account in a journal entry, we should be able to merge
             the lines together and get closer to correct entries for migration.
+
+            The journal entries are fixed in chunks of chunk_size consecutive account.move ids, each committed on its
+            own and recorded as done in the durpro_fix_chunk checkpoint table. If the fix is interrupted, running it
+            again resumes with the chunks not done. The chunks are independent, so they are fixed by several workers at
+            once, each with its own database connection. The lines merged away are zeroed in their chunk, so that every
+            committed entry stays balanced, and are only deleted, with their foreign key references moved to the lines
+            they were merged into, once all the chunks are done.
+        :param chunk_size: The number of journal entries per chunk, used when the chunks are first planned.
+        :param workers: The number of chunks fixed at the same time. With 1, they are fixed in the current
+            transaction's connection.
         :return:
         """
-        self._copy_and_verify_aml_table()
+        self._plan_chunks(chunk_size)
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(self._fix_chunks_in_new_cursor) for i in range(workers)]:
+                    future.result()
+        else:
+            self._fix_chunks()
+        self.env.cr.execute("SELECT count(*) FROM durpro_fix_chunk WHERE state <> 'done'")
+        not_done = self.env.cr.fetchone()[0]
+        if not_done:
+            _logger.error(f"{not_done} chunks could not be fixed, not merging lines. See durpro_fix_chunk.")
+            return
+        _logger.info("All chunks are done. Merging lines.")
+        self._merge_delete_lines()
+        _logger.info("Done merging and committing. Cleaning up.")
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_to_delete")
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_chunk")
+        self.env.cr.commit()
+        _logger.info("Done cleaning up. Fix complete.")
+
+    @api.model
+    def _plan_chunks(self, chunk_size):
+        """ Split the journal entries into chunks of chunk_size consecutive ids in the durpro_fix_chunk checkpoint
+        table, unless it already exists from an interrupted run. """
+        self.env.cr.execute("SELECT to_regclass('durpro_fix_chunk')")
+        if self.env.cr.fetchone()[0]:
+            self.env.cr.execute("SELECT count(*) FILTER (WHERE state = 'done'), count(*) FROM durpro_fix_chunk")
+            done, total = self.env.cr.fetchone()
+            _logger.info(f"Resuming the fix, {done} of {total} chunks are done.")
+            self.env.cr.execute("ALTER TABLE durpro_fix_chunk ADD COLUMN IF NOT EXISTS error text")
+            self.env.cr.execute("UPDATE durpro_fix_chunk SET state = 'pending', error = NULL WHERE state = 'failed'")
+            self.env.cr.commit()
+            return
+        self.env.cr.execute("""CREATE TABLE durpro_fix_chunk (id serial primary key, move_from int, move_to int, 
+        state varchar NOT NULL DEFAULT 'pending', done_at timestamp, error text)""")
+        self.env.cr.execute("""
+            INSERT INTO durpro_fix_chunk (move_from, move_to)
+            SELECT min(id), max(id)
+            FROM (SELECT id, (row_number() OVER (ORDER BY id) - 1) / %s AS chunk FROM account_move) moves
+            GROUP BY chunk
+            ORDER BY chunk
+        """, [chunk_size])
+        _logger.info(f"Fixing the journal entries in {self.env.cr.rowcount} chunks.")
+        # The lines merged away in all the chunks, with the line they were merged into
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_to_delete")
+        self.env.cr.execute("CREATE TABLE durpro_fix_aml_to_delete (move_line_id int primary key, keeper_id int)")
+        self.env.cr.commit()
+
+    @api.model
+    def _fix_chunks_in_new_cursor(self):
+        """ Run _fix_chunks as a worker with its own cursor, thus its own connection. """
+        with self.pool.cursor() as cr:
+            self.with_env(self.env(cr=cr))._fix_chunks()
+
+    @api.model
+    def _fix_chunks(self):
+        """ Claim and fix the pending chunks one at a time until there are none left. The claimed chunk stays locked
+        until its transaction ends, so that other workers skip it. A chunk that can't be fixed is rolled back to before
+        its fix and marked as failed with the error, to be retried when the fix is resumed. """
+        while True:
+            try:
+                self.env.cr.execute("""SELECT id, move_from, move_to FROM durpro_fix_chunk 
+                                       WHERE state = 'pending' ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED""",
+                                    log_exceptions=False)
+            except SerializationFailure:
+                # Another worker completed the chunk since this transaction's snapshot, try again with a new one
+                self.env.cr.rollback()
+                continue
+            chunk = self.env.cr.fetchone()
+            if not chunk:
+                return
+            chunk_id, move_from, move_to = chunk
+            try:
+                with self.env.cr.savepoint():
+                    self._fix_chunk(move_from, move_to)
+            except Exception as e:
+                _logger.exception(f"Could not fix journal entries {move_from} to {move_to}.")
+                self.env.cr.execute("UPDATE durpro_fix_chunk SET state = 'failed', error = %s WHERE id = %s",
+                                    [str(e), chunk_id])
+            else:
+                self.env.cr.execute("""UPDATE durpro_fix_chunk SET state = 'done', done_at = now() at time zone 'UTC' 
+                                       WHERE id = %s""", [chunk_id])
+            self.env.cr.commit()
+
+    @api.model
+    def _fix_chunk(self, move_from, move_to):
+        """ Fix the journal entries with ids from move_from to move_to. The caller commits them along with the chunk's
+        checkpoint.
+
+        :raise ValidationError: If the balances don't match after the fix.
+        """
+        _logger.info(f"Fixing journal entries {move_from} to {move_to}.")
+        self._copy_and_verify_aml_table(move_from, move_to)
         self._correct_multi_currency_entries()
 
-        problem_lines = self._get_problem_account_move_lines()
-        to_merge = {}
         # Merge each group of counterpart lines into a single line
-        if problem_lines:
-            _logger.info(f"Updating {len(problem_lines)} problematic lines")
-            to_merge = self._run_updates(problem_lines)
-        else:
-            _logger.info(f"Found no problematic entries. Moving on.")
+        self._merge_problem_lines()
         # Check debit and credit balances
         if not self._check_debit_credit_balances():
-            return
+            raise ValidationError("Debit and credit balances do not match after the fix.")
         self._check_problematic_entries()
-        _logger.info("Committing changes and merging lines.")
+        _logger.info("Writing changes.")
         self.env.cr.execute(""" UPDATE account_move_line SET debit = aml.debit, credit = aml.credit,  
                                     balance = aml.balance, amount_currency = aml.amount_currency, 
                                     currency_id = aml.currency_id
                                 FROM durpro_fix_aml aml
                                 WHERE account_move_line.id = aml.id""")
-        self._merge_entries(to_merge)
-        _logger.info("Done merging and committing. Cleaning up.")
-        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml")
-        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_keepers")
-        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_to_delete")
-        self.env.cr.commit()
-        _logger.info("Done cleaning up. Fix complete.")
+        # Zero the lines merged into the keepers so that the committed entries stay balanced until they're deleted
+        self.env.cr.execute(""" UPDATE account_move_line SET debit = 0, credit = 0, balance = 0, amount_currency = 0
+                                FROM durpro_fix_aml_to_delete d
+                                WHERE account_move_line.id = d.move_line_id
+                                    AND account_move_line.move_id BETWEEN %s AND %s""", [move_from, move_to])
 
     @api.model
-    def _get_problem_account_move_lines(self):
-        _logger.info("Getting problematic lines")
-        # Get the move lines grouped by account to see which ones we can match up
+    def _merge_problem_lines(self):
+        """ Merge the lines of each journal entry that share a receivable, payable, liquidity or transfer account into
+        the one with the smallest id (the keeper), all in SQL.
+
+        The keepers get the aggregated amounts of their group and are recorded in durpro_fix_aml_keepers, while the
+        other lines of the group are added with their keeper to durpro_fix_aml_to_delete and removed from
+        durpro_fix_aml. The amount_currency of the keepers follows the same rules as _get_amount_currency.
+        """
+        _logger.info("Merging problematic lines")
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_keepers")
+        self.env.cr.execute("""CREATE TEMP TABLE durpro_fix_aml_keepers (move_line_id int primary key, debit numeric, 
+        credit numeric, amount_currency numeric, balance numeric) ON COMMIT DROP""")
         self.env.cr.execute("""
-            select am.id as move_id, aml.account_id, am.currency_id as currency_id, string_agg(distinct(aml.id)::text, ',') as aml_ids, 
-                sum(aml.debit) as debit, sum(aml.amount_currency) as amount_currency, sum(aml.credit) as credit
-            from account_move am 
-                inner join durpro_fix_aml aml on am.id = aml.move_id
-                inner join account_account a on aml.account_id = a.id
-                inner join res_company company on am.company_id = company.id
-                inner join account_journal j on am.journal_id = j.id
-            where (internal_type in ('receivable', 'payable', 'liquidity')
-                    or aml.account_id = company.transfer_account_id)
-            group by aml.account_id, am.id, am.currency_id
-            having count(*) > 1
+            INSERT INTO durpro_fix_aml_keepers (move_line_id, debit, credit, amount_currency, balance)
+            SELECT move_line_id, debit, credit,
+                CASE
+                    WHEN currency_id = %(company_currency_id)s THEN round(sum_debit - sum_credit, 2)
+                    WHEN sum_debit - sum_credit > 0 THEN round(abs(amount_currency), 2)
+                    ELSE round(-abs(amount_currency), 2)
+                END,
+                debit - credit
+            FROM (
+                select min(aml.id) as move_line_id, am.currency_id as currency_id,
+                    sum(aml.debit) as sum_debit, sum(aml.credit) as sum_credit,
+                    sum(aml.amount_currency) as amount_currency,
+                    round(greatest(sum(aml.debit) - sum(aml.credit), 0), 2) as debit,
+                    round(greatest(sum(aml.credit) - sum(aml.debit), 0), 2) as credit
+                from account_move am
+                    inner join durpro_fix_aml aml on am.id = aml.move_id
+                    inner join account_account a on aml.account_id = a.id
+                    inner join res_company company on am.company_id = company.id
+                where (internal_type in ('receivable', 'payable', 'liquidity')
+                        or aml.account_id = company.transfer_account_id)
+                group by aml.account_id, am.id, am.currency_id
+                having count(*) > 1
+            ) groups
+        """, {'company_currency_id': COMPANY_CURRENCY_ID})
+        _logger.info(f"Merging {self.env.cr.rowcount} groups of problematic lines")
+
+        # Every other line of the keeper's move and account belongs to its group
+        self.env.cr.execute("""
+            INSERT INTO durpro_fix_aml_to_delete (move_line_id, keeper_id)
+            SELECT aml.id, k.move_line_id
+            FROM durpro_fix_aml_keepers k
+                inner join durpro_fix_aml keeper on keeper.id = k.move_line_id
+                inner join durpro_fix_aml aml on aml.move_id = keeper.move_id and aml.account_id = keeper.account_id
+                    and aml.id <> keeper.id
         """)
-        problem_lines = self.env.cr.dictfetchall()
-        return problem_lines
+
+        _logger.info("Updating values for lines to keep ...")
+        self.env.cr.execute("""
+            UPDATE durpro_fix_aml aml set debit = k.debit, credit = k.credit, amount_currency = k.amount_currency, 
+                balance = k.balance
+            FROM durpro_fix_aml_keepers k
+            WHERE aml.id = k.move_line_id""")
+        _logger.info("Deleting extra lines ...")
+        self.env.cr.execute("""DELETE FROM durpro_fix_aml aml USING durpro_fix_aml_to_delete d
+                               WHERE aml.id = d.move_line_id""")
 
     @api.model
     def _correct_multi_currency_entries(self):
@@ -103,10 +249,37 @@ class AccountMoveLine(models.Model):
             _logger.info(f"No entries with two or more currencies found.")
 
     @api.model
-    def _copy_and_verify_aml_table(self):
-        # Start by working on a copy of the account.move.line table
+    def _copy_and_verify_aml_table(self, move_from, move_to):
+        # Find the journal entries of the chunk that need fixing: those with more than one currency or more than one
+        # line on the same counterpart account
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_moves")
+        self.env.cr.execute("CREATE TEMP TABLE durpro_fix_moves (id int primary key) ON COMMIT DROP")
+        self.env.cr.execute("""
+            INSERT INTO durpro_fix_moves (id)
+            select am.id
+            from account_move_line aml
+                inner join account_move am on am.id=aml.move_id
+            where am.id between %(move_from)s and %(move_to)s and am.state not in ('draft','cancel')
+            group by am.id
+            having count(distinct aml.currency_id) > 1
+            UNION
+            select am.id
+            from account_move am
+                inner join account_move_line aml on am.id = aml.move_id
+                inner join account_account a on aml.account_id = a.id
+                inner join res_company company on am.company_id = company.id
+            where am.id between %(move_from)s and %(move_to)s
+                and (internal_type in ('receivable', 'payable', 'liquidity')
+                    or aml.account_id = company.transfer_account_id)
+            group by aml.account_id, am.id
+            having count(*) > 1
+        """, {'move_from': move_from, 'move_to': move_to})
+        _logger.info(f"Found {self.env.cr.rowcount} journal entries to fix.")
+        # Work on a copy of their lines
         self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml")
-        self.env.cr.execute("CREATE TABLE durpro_fix_aml AS TABLE account_move_line")
+        self.env.cr.execute("""CREATE TEMP TABLE durpro_fix_aml ON COMMIT DROP AS 
+                               SELECT aml.* FROM account_move_line aml 
+                                   INNER JOIN durpro_fix_moves m ON m.id = aml.move_id""")
         _logger.info("Checking debit credit balances between copied table and original before proceeding.")
         if not self._check_debit_credit_balances():
             raise ValidationError("Debit and credit balances do not match between copied table and original."
@@ -133,85 +306,6 @@ class AccountMoveLine(models.Model):
         else:
             _logger.info("All journal entries have been fixed.")
 
-    @api.model
-    def _run_updates(self, lines) -> List[Tuple[int, Set[int]]]:
-        updates = []
-        for line in lines:
-            move_line_id = int(line['aml_ids'].split(',')[0])
-            line_ids_to_merge = set(int(line_id) for line_id in line['aml_ids'].split(',')[1:])
-            if not line_ids_to_merge:
-                continue
-            debit = round(max(line['debit'] - line['credit'], 0), 2)
-            credit = round(max(line['credit'] - line['debit'], 0), 2)
-            amount_currency = self._get_amount_currency(line)
-            balance = round(debit - credit, 2)
-            updates.append({
-                'move_line_id': move_line_id,
-                'line_ids_to_merge': line_ids_to_merge,
-                'debit': debit,
-                'credit': credit,
-                'amount_currency': amount_currency,
-                'balance': balance,
-            })
-        _logger.info("Updating values for lines to keep ...")
-        self._update_keeper_lines(updates)
-        _logger.info("Deleting extra lines ...")
-        self._delete_extra_lines(updates)
-        return [(update['move_line_id'], update['line_ids_to_merge']) for update in updates]
-
-    @api.model
-    def _update_keeper_lines(self, updates) -> None:
-        """ Update the keeper lines with the new debit/credit/amount_currency
-
-        :param updates: A list of dictionaries with the following keys:
-            move_line_id: The id of the keeper line
-            debit: The new debit balance
-            credit: The new credit balance
-            amount_currency: The new amount_currency balance
-            line_ids_to_merge: A list of ids of the lines to merge into the keeper line
-        """
-        # Insert the keepers into a temporary table
-        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_keepers")
-        self.env.cr.execute("""CREATE TABLE durpro_fix_aml_keepers (move_line_id int primary key, debit numeric, 
-        credit numeric, amount_currency numeric, balance numeric)""")
-        tups = tuple(
-            (update['move_line_id'], update['debit'], update['credit'], update['amount_currency'], update['balance'])
-            for update in updates)
-        args_str = ','.join(str(tup) for tup in tups)
-        self.env.cr.execute(
-            "INSERT INTO durpro_fix_aml_keepers (move_line_id, debit, credit, amount_currency, balance) "
-            "VALUES " + args_str)
-
-        # Update all the keepers from the temporary table
-        sql = """
-            UPDATE durpro_fix_aml aml set debit = k.debit, credit = k.credit, amount_currency = k.amount_currency, 
-                balance = k.balance
-            FROM durpro_fix_aml_keepers k
-            WHERE aml.id = k.move_line_id"""
-        self.env.cr.execute(sql)
-
-    @api.model
-    def _delete_extra_lines(self, updates):
-        extra_line_ids = tuple(line_id for update in updates for line_id in update['line_ids_to_merge'])
-        sql = """DELETE FROM durpro_fix_aml WHERE id in """ + str(extra_line_ids)
-        self.env.cr.execute(sql)
-
-    @api.model
-    def _merge_entries(self, updates):
-        """ Merge the lines to delete into the keeper line, keeping all foreign key references across the DB intact.
-
-        :param updates: A tuple containing:
-            [0]: The id of the keeper line
-            [1]: A list of ids of the lines to merge into the keeper line
-        """
-        # Create a temporary table to hold the ids of the lines to delete and relate them to the "keeper" id
-        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_to_delete")
-        self.env.cr.execute("CREATE TABLE durpro_fix_aml_to_delete (move_line_id int primary key, keeper_id int)")
-        tups = tuple((line_id, update[0]) for update in updates for line_id in update[1])
-        args_str = ','.join(str(tup) for tup in tups)
-        self.env.cr.execute("INSERT INTO durpro_fix_aml_to_delete (move_line_id, keeper_id) VALUES" + args_str)
-        self._merge_delete_lines()
-
     @api.model
     def _merge_delete_lines(self):
         fk_tables = self._get_applicable_foreign_keys()
@@ -258,7 +352,6 @@ class AccountMoveLine(models.Model):
                                           FROM %(table)s) as main2)
                             """ % params
                 self.env.cr.execute(sql)
-        self.env.cr.execute("DELETE FROM durpro_fix_aml WHERE id in (SELECT move_line_id FROM durpro_fix_aml_to_delete)")
 
     @api.model
     def _update_table_column(self, column, table):
@@ -333,7 +426,7 @@ class AccountMoveLine(models.Model):
         :return: The amount_currency balance with the correct sign
         """
         new_currency_id = line['currency_id'] if not new_currency_id else new_currency_id
-        if new_currency_id == 4:
+        if new_currency_id == COMPANY_CURRENCY_ID:
             return round(line['debit'] - line['credit'], 2)
         else:
             line_balance_positive = line['debit'] - line['credit'] > 0
@@ -349,66 +442,68 @@ class AccountMoveLine(models.Model):
         :param lines: A list of dictionaries with at least the keys "move_id" and "move_currency_id" representing the
                       moves to fix
         """
-        move_ids = str(tuple(line['move_id'] for line in lines))
         sql = """
         SELECT aml.id as line_id, aml.currency_id as currency_id, aml.move_id as move_id, aml.debit as debit,
                aml.credit as credit, aml.amount_currency as amount_currency
         FROM durpro_fix_aml aml
         WHERE aml.move_id in %s
-    """ % move_ids
-        self.env.cr.execute(sql)
+    """
+        self.env.cr.execute(sql, [tuple(line['move_id'] for line in lines)])
         move_currency_dict = {line['move_id']: line['currency_id'] for line in lines}
         move_lines = self.env.cr.dictfetchall()
         updates = (
-            {
-                'id': line['line_id'],
-                'currency_id': move_currency_dict[line['move_id']],
-                'amount_currency': self._get_amount_currency(line, move_currency_dict[line['move_id']]),
-            }
+            (line['line_id'], move_currency_dict[line['move_id']],
+             self._get_amount_currency(line, move_currency_dict[line['move_id']]))
             for line in move_lines if line['currency_id'] != move_currency_dict[line['move_id']]
         )
-        tups = tuple((update['id'], update['currency_id'], update['amount_currency']) for update in updates)
-        args_str = ','.join(str(tup) for tup in tups)
+        self.env.cr.execute("DROP TABLE IF EXISTS durpro_fix_aml_currencies")
+        self.env.cr.execute("""CREATE TEMP TABLE durpro_fix_aml_currencies (id int primary key, currency_id int,
+        amount_currency numeric) ON COMMIT DROP""")
+        copy_rows(self.env.cr, 'durpro_fix_aml_currencies', ('id', 'currency_id', 'amount_currency'), updates)
         sql = """UPDATE durpro_fix_aml SET currency_id = v.currency_id, amount_currency = v.amount_currency
-             FROM (VALUES %s) AS v(id, currency_id, amount_currency) WHERE v.id = durpro_fix_aml.id""" % args_str
+             FROM durpro_fix_aml_currencies v WHERE v.id = durpro_fix_aml.id"""
         self.env.cr.execute(sql)
+        self.env.cr.execute("DROP TABLE durpro_fix_aml_currencies")
 
     @api.model
     def _check_debit_credit_balances(self) -> bool:
-        """ """
-        self.env.cr.execute(
-            "SELECT move_id, account_id, sum(debit) as debits, sum(credit) as credits FROM durpro_fix_aml group by move_id, account_id")
-        new_balances = self.env.cr.dictfetchall()
-        self.env.cr.execute(
-            "SELECT move_id, account_id, sum(debit) as debits, sum(credit) as credits FROM account_move_line group by move_id, account_id")
-        old_balances = self.env.cr.dictfetchall()
-        old_balances_dict = {}
-        for old_balance in old_balances:
-            move_id = old_balance['move_id']
-            account_id = old_balance['account_id']
-            if move_id in old_balances_dict:
-                if not old_balances_dict[move_id].get(account_id):
-                    old_balances_dict[move_id][account_id] = old_balance
-                else:
-                    raise ValidationError(f"Duplicate account {account_id} in move {move_id}")
-            else:
-                old_balances_dict[move_id] = {account_id: old_balance}
-        mismatch = False
-        for new_balance in new_balances:
-            move_id = new_balance['move_id']
-            account_id = new_balance['account_id']
-            new_debit = round(new_balance['debits'], 2)
-            new_credit = round(new_balance['credits'], 2)
-            old_debit = round(old_balances_dict[move_id][account_id]['debits'], 2)
-            old_credit = round(old_balances_dict[move_id][account_id]['credits'], 2)
-            if abs(round(new_debit - new_credit, 2)) != abs(round(old_debit - old_credit, 2)):
-                mismatch = True
-                _logger.error(
-                    f"Mismatch detected in debit and credit totals for move {new_balance['move_id']}, account {new_balance['account_id']}.")
+        """ Compare the balance of every (move, account) pair of durpro_fix_aml with the one in account_move_line, for
+        the journal entries being fixed (durpro_fix_moves).
+
+        Both sides are aggregated and joined in the database, which only returns the mismatching pairs. These are read
+        through a server-side cursor to log them.
+        """
+        sql = """
+            WITH new_balances AS (
+                SELECT move_id, coalesce(account_id, 0) AS account_id,
+                    round(sum(debit), 2) AS debits, round(sum(credit), 2) AS credits
+                FROM durpro_fix_aml
+                GROUP BY move_id, coalesce(account_id, 0)
+            ), old_balances AS (
+                SELECT move_id, coalesce(account_id, 0) AS account_id,
+                    round(sum(debit), 2) AS debits, round(sum(credit), 2) AS credits
+                FROM account_move_line
+                WHERE move_id IN (SELECT id FROM durpro_fix_moves)
+                GROUP BY move_id, coalesce(account_id, 0)
+            )
+            SELECT coalesce(n.move_id, o.move_id), coalesce(n.account_id, o.account_id),
+                coalesce(o.debits, 0), coalesce(o.credits, 0), coalesce(n.debits, 0), coalesce(n.credits, 0)
+            FROM new_balances n
+                FULL OUTER JOIN old_balances o ON o.move_id = n.move_id AND o.account_id = n.account_id
+            WHERE abs(coalesce(n.debits, 0) - coalesce(n.credits, 0))
+                <> abs(coalesce(o.debits, 0) - coalesce(o.credits, 0))
+        """
+        mismatches = 0
+        with closing(self.env.cr._cnx.cursor('durpro_fix_balance_mismatches')) as cursor:
+            cursor.itersize = 1000
+            cursor.execute(sql)
+            for move_id, account_id, old_debit, old_credit, new_debit, new_credit in cursor:
+                mismatches += 1
+                _logger.error(f"Mismatch detected in debit and credit totals for move {move_id}, account {account_id}.")
                 _logger.error(f"Old debit: {old_debit}, Old credit: {old_credit}")
                 _logger.error(f"New debit: {new_debit}, New credit: {new_credit}")
-        if mismatch:
-            self.env.cr.rollback()
+        if mismatches:
+            _logger.error(f"Found {mismatches} mismatched balances.")
             return False
         _logger.info("Debit and credit balances match between new and old entries.")
         return True
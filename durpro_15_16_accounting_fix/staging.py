@@ -0,0 +1,42 @@
+from typing import Iterable, Sequence
+
+# Characters that must be escaped in the text format of COPY
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return '\\N'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class _RowStream:
+    """A file-like view of an iterable of rows, in the text format of COPY. Rows are only formatted as COPY reads them,
+    so that the rows never need to be held in memory all at once."""
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._lines = ('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_rows(cr, table: str, columns: Sequence[str], rows: Iterable[Sequence], page_size: int = 65536) -> None:
+    """Load rows into a staging table with COPY FROM STDIN, streaming them in pages of page_size characters.
+
+    :param table: The name of the table to load, which must exist.
+    :param columns: The columns of the table the values of each row go to, in order.
+    :param rows: An iterable (ideally a generator) of rows. An empty one loads nothing.
+    """
+    sql = "COPY %s (%s) FROM STDIN" % (table, ', '.join(columns))
+    cr.copy_expert(sql, _RowStream(rows), size=page_size)
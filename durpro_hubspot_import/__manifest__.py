@@ -1,6 +1,6 @@
 {
     "name": "Durpro HubSpot Import",
-    "version": "1.0",
+    "version": "1.4",
     "license": "Other proprietary",
     "author": "Durpro Ltd",
     "category": "Generic Modules/Others",
@@ -16,6 +16,9 @@
         "data/hubspot_import_data.xml",
         "views/res_config_settings_views.xml",
         "views/hubspot_import_views.xml",
+        "views/import_job_views.xml",
+        "views/import_metric_views.xml",
+        "views/auto_importer_views.xml",
         "views/pipeline_views.xml",
         "security/ir.model.access.csv",
         "wizard/hubspot_import_wizard_views.xml",
@@ -0,0 +1,477 @@
+"""A stand-in for the HubSpot API, serving a synthetic portal so that the import can be run and measured without a live
+HubSpot portal (see run_benchmark.py).
+
+It serves the endpoints the import uses, in the shapes returned by HubSpot:
+
+  - GET  /crm/v3/objects/{type} and POST /crm/v3/objects/{type}/search for tickets, contacts, companies, notes and
+    emails, with the properties documented in ../readme/*_properties.json,
+  - GET  /crm/v3/owners/ and GET /crm/v3/pipelines/tickets,
+  - POST /crm/v3/associations/tickets/{type}/batch/read,
+  - GET  /files/v3/files/{id}, GET /files/v3/files/{id}/signed-url and the signed URL downloads themselves.
+
+Objects are generated from their id, so portals of millions of objects cost no memory. Latency and 429 responses can be
+injected on the API calls (not on the downloads, which HubSpot serves from its CDN).
+
+Usage:
+    python fake_hubspot.py --objects 100000 --port 8765 --latency 50 --error-rate 0.01
+
+then set the durpro_hubspot_sync.api_host system parameter to http://localhost:8765.
+"""
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+
+README_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'readme')
+PROPERTY_FILES = {
+    'tickets': 'ticket_properties.json',
+    'contacts': 'contacts_properties.json',
+    'companies': 'company_properties.json',
+    'notes': 'notes_properties.json',
+    'emails': 'email_properties.json',
+}
+# Share of the portal's objects of each type
+OBJECT_SHARES = {
+    'tickets': 0.2,
+    'contacts': 0.15,
+    'companies': 0.05,
+    'notes': 0.25,
+    'emails': 0.35,
+}
+OWNERS = 50
+PIPELINES = 2
+STAGES_PER_PIPELINE = 5
+CREATED_AT = datetime(2020, 1, 1, tzinfo=timezone.utc)
+# HubSpot caps the results of a search at 10000
+SEARCH_MAX_RESULTS = 10000
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def _iso(dt: datetime) -> str:
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def _load_property_types() -> dict:
+    """The HubSpot type of each documented property, by object type."""
+    types = {}
+    for object_type, filename in PROPERTY_FILES.items():
+        with open(os.path.join(README_DIR, filename)) as f:
+            types[object_type] = {p['name']: (p['type'], p.get('options') or []) for p in json.load(f)['results']}
+    return types
+
+
+class Portal:
+    """A synthetic HubSpot portal of about the given number of objects, split between the object types as in
+    OBJECT_SHARES. Notes and emails reference files through hs_attachment_ids, some files being shared between several
+    of them. A share of the objects (changed_share) is reported as modified at the time of each search, so that
+    incremental syncs have changes to carry over."""
+
+    def __init__(self, objects: int, attachment_share: float = 0.1, file_size: int = 200 * 1024,
+                 changed_share: float = 0.01):
+        self.counts = {object_type: max(1, int(objects * share)) for object_type, share in OBJECT_SHARES.items()}
+        self.attachment_share = attachment_share
+        self.file_size = file_size
+        self.changed_share = changed_share
+        # Four records out of five with attachments reference a file of their own, the others a shared one
+        with_attachments = (self.counts['notes'] + self.counts['emails']) * attachment_share
+        self.counts['files'] = max(1, int(with_attachments * 0.8))
+        self.property_types = _load_property_types()
+        self._changed_ids = {}
+        self._changed_lock = threading.Lock()
+
+    def _rng(self, object_type: str, object_id: int) -> random.Random:
+        return random.Random(f"{object_type}:{object_id}")
+
+    def is_changed(self, object_type: str, object_id: int) -> bool:
+        return self._rng(object_type, object_id).random() < self.changed_share
+
+    def changed_ids(self, object_type: str) -> list:
+        with self._changed_lock:
+            if object_type not in self._changed_ids:
+                self._changed_ids[object_type] = [i for i in range(1, self.counts[object_type] + 1)
+                                                  if self.is_changed(object_type, i)]
+            return self._changed_ids[object_type]
+
+    def created_at(self, object_id: int) -> datetime:
+        return CREATED_AT + timedelta(minutes=object_id)
+
+    def modified_at(self, object_type: str, object_id: int) -> datetime:
+        if self.is_changed(object_type, object_id):
+            return datetime.now(timezone.utc)
+        return self.created_at(object_id) + timedelta(days=1)
+
+    def contact_email(self, contact_id: int) -> str:
+        return f"contact{contact_id}@example.com"
+
+    def _attachment_ids(self, rng: random.Random) -> str:
+        if rng.random() >= self.attachment_share:
+            return ""
+        return ";".join(str(rng.randint(1, self.counts['files'])) for _i in range(rng.choice((1, 1, 1, 2, 3))))
+
+    def _value(self, object_type: str, name: str, object_id: int, rng: random.Random):
+        """A plausible value for a property, by its documented type."""
+        hs_type, options = self.property_types[object_type].get(name, ('string', []))
+        if hs_type == 'datetime':
+            return _iso(self.created_at(object_id))
+        if hs_type == 'date':
+            return self.created_at(object_id).strftime('%Y-%m-%d')
+        if hs_type == 'number':
+            return str(rng.randint(0, 10000))
+        if hs_type == 'bool':
+            return rng.choice(('true', 'false'))
+        if hs_type == 'enumeration':
+            return rng.choice(options)['value'] if options else ""
+        if hs_type == 'json':
+            return "{}"
+        if hs_type == 'phone_number':
+            return f"+1 514 555 {object_id % 10000:04d}"
+        return f"{name} {object_id}"
+
+    def _overrides(self, object_type: str, object_id: int, rng: random.Random) -> dict:
+        """The properties the import relies on, consistent across the portal."""
+        contact_id = rng.randint(1, self.counts['contacts'])
+        owner_id = rng.randint(1, OWNERS)
+        if object_type == 'tickets':
+            pipeline = rng.randint(1, PIPELINES)
+            return {
+                'subject': f"Ticket {object_id}",
+                'content': f"Synthetic ticket {object_id}\nwith a second line.",
+                'hs_pipeline': str(pipeline),
+                'hs_pipeline_stage': f"{pipeline}{rng.randint(1, STAGES_PER_PIPELINE)}",
+                'hubspot_owner_id': str(owner_id),
+            }
+        if object_type == 'contacts':
+            return {
+                'email': self.contact_email(object_id),
+                'firstname': f"First{object_id}",
+                'lastname': f"Last{object_id}",
+            }
+        if object_type == 'companies':
+            return {'name': f"Company {object_id}", 'domain': f"company{object_id}.example.com"}
+        if object_type == 'notes':
+            return {
+                'hs_note_body': f"<p>Note {object_id}</p>" * rng.randint(1, 20),
+                'hubspot_owner_id': str(owner_id),
+                'hs_attachment_ids': self._attachment_ids(rng),
+            }
+        if object_type == 'emails':
+            paragraphs = "".join(f"<p>Paragraph {i} of email {object_id}.</p>" for i in range(rng.randint(1, 50)))
+            return {
+                'hs_email_subject': f"Email {object_id}",
+                'hs_email_html': f"<html><body><div style='color: #333'>{paragraphs}</div></body></html>"
+                if rng.random() < 0.8 else paragraphs,
+                'hs_email_text': f"Email {object_id}",
+                'hs_email_from_email': self.contact_email(contact_id),
+                'hs_email_to_email': f"owner{owner_id}@example.com",
+                'hs_email_cc_email': "",
+                'hs_email_direction': rng.choice(('INCOMING_EMAIL', 'EMAIL')),
+                'hubspot_owner_id': str(owner_id),
+                'hs_attachment_ids': self._attachment_ids(rng),
+            }
+        return {}
+
+    def get_object(self, object_type: str, object_id: int, properties) -> dict:
+        rng = self._rng(object_type, object_id)
+        overrides = self._overrides(object_type, object_id, rng)
+        modified_at = self.modified_at(object_type, object_id)
+        values = {}
+        for name in properties:
+            if name in overrides:
+                values[name] = overrides[name]
+            elif name == 'hs_object_id':
+                values[name] = str(object_id)
+            elif name in ('hs_lastmodifieddate', 'lastmodifieddate'):
+                values[name] = _iso(modified_at)
+            else:
+                values[name] = self._value(object_type, name, object_id, rng)
+        return {
+            'id': str(object_id),
+            'properties': values,
+            'createdAt': _iso(self.created_at(object_id)),
+            'updatedAt': _iso(modified_at),
+            'archived': False,
+        }
+
+    def associated_ids(self, object_type: str, ticket_id: int) -> list:
+        """The ids of the objects of object_type associated with a ticket: one contact and one company, and the notes
+        and emails spread evenly between the tickets."""
+        count = self.counts[object_type]
+        if object_type in ('contacts', 'companies'):
+            return [self._rng('tickets', ticket_id).randint(1, count)]
+        tickets = self.counts['tickets']
+        return list(range(1 + (ticket_id - 1) * count // tickets, 1 + ticket_id * count // tickets))
+
+    def get_owner(self, owner_id: int) -> dict:
+        return {
+            'id': str(owner_id),
+            'email': f"owner{owner_id}@example.com",
+            'firstName': f"Owner{owner_id}",
+            'lastName': "Synthetic",
+            'userId': owner_id,
+            'createdAt': _iso(CREATED_AT),
+            'updatedAt': _iso(CREATED_AT),
+            'archived': False,
+        }
+
+    def get_pipelines(self) -> list:
+        return [{
+            'id': str(pipeline),
+            'label': f"Pipeline {pipeline}",
+            'displayOrder': pipeline,
+            'createdAt': _iso(CREATED_AT),
+            'updatedAt': _iso(CREATED_AT),
+            'archived': False,
+            'stages': [{
+                'id': f"{pipeline}{stage}",
+                'label': f"Stage {stage}",
+                'displayOrder': stage,
+                'metadata': {'ticketState': 'CLOSED' if stage == STAGES_PER_PIPELINE else 'OPEN'},
+                'createdAt': _iso(CREATED_AT),
+                'updatedAt': _iso(CREATED_AT),
+                'archived': False,
+            } for stage in range(1, STAGES_PER_PIPELINE + 1)],
+        } for pipeline in range(1, PIPELINES + 1)]
+
+    def get_file(self, file_id: int) -> dict:
+        return {
+            'id': str(file_id),
+            'name': f"file-{file_id}",
+            'extension': 'pdf',
+            'type': 'DOCUMENT',
+            'size': self.file_size,
+            'createdAt': _iso(self.created_at(file_id)),
+            'updatedAt': _iso(self.created_at(file_id)),
+            'archived': False,
+            'access': 'PRIVATE',
+        }
+
+    def file_chunks(self, file_id: int):
+        """The contents of a file, unique to it, by chunks."""
+        header = b"%PDF-1.4\n% synthetic file " + str(file_id).encode() + b"\n"
+        filler = random.Random(file_id).randbytes(256) * (DOWNLOAD_CHUNK_SIZE // 256)
+        remaining = self.file_size
+        chunk = header
+        while remaining > 0:
+            chunk = chunk[:remaining]
+            yield chunk
+            remaining -= len(chunk)
+            chunk = filler
+
+
+class FakeHubSpotHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Set on the server class by serve()
+    portal = None
+    latency = 0.0
+    error_rate = 0.0
+
+    routes = [
+        ('GET', re.compile(r'^/crm/v3/objects/(\w+)$'), '_get_page'),
+        ('POST', re.compile(r'^/crm/v3/objects/(\w+)/search$'), '_search'),
+        ('GET', re.compile(r'^/crm/v3/owners/?$'), '_get_owners'),
+        ('GET', re.compile(r'^/crm/v3/pipelines/tickets$'), '_get_pipelines'),
+        ('POST', re.compile(r'^/crm/v3/associations/tickets/(\w+)/batch/read$'), '_read_associations'),
+        ('GET', re.compile(r'^/files/v3/files/(\d+)$'), '_get_file'),
+        ('GET', re.compile(r'^/files/v3/files/(\d+)/signed-url$'), '_get_signed_url'),
+        ('GET', re.compile(r'^/_download/(\d+)$'), '_download'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = json.loads(self.rfile.read(length)) if length else {}
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                if handler != '_download':
+                    if self.latency:
+                        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+                    if random.random() < self.error_rate:
+                        return self._send_json({
+                            'status': 'error',
+                            'message': "You have reached your secondly limit.",
+                            'errorType': 'RATE_LIMIT',
+                            'policyName': 'SECONDLY',
+                        }, status=429)
+                return getattr(self, handler)(*match.groups())
+        self._send_json({'status': 'error', 'message': f"Not found: {method} {url.path}"}, status=404)
+
+    def _send_json(self, payload, status: int = 200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _properties(self) -> list:
+        properties = []
+        for value in self.query.get('properties', []):
+            properties.extend(p for p in value.split(',') if p)
+        return properties
+
+    def _page(self, ids, after: int, limit: int, total: int, build) -> dict:
+        results = [build(i) for i in ids]
+        page = {'results': results}
+        if after + limit < total:
+            page['paging'] = {'next': {'after': str(after + limit)}}
+        return page
+
+    def _get_page(self, object_type: str):
+        count = self.portal.counts.get(object_type)
+        if count is None:
+            return self._send_json({'status': 'error', 'message': f"Unknown object type {object_type}"}, status=400)
+        after = int(self.query.get('after', ['0'])[0] or 0)
+        limit = min(int(self.query.get('limit', ['10'])[0]), 100)
+        properties = self._properties()
+        ids = range(after + 1, min(after + limit, count) + 1)
+        self._send_json(self._page(ids, after, limit, count,
+                                   lambda i: self.portal.get_object(object_type, i, properties)))
+
+    def _search(self, object_type: str):
+        count = self.portal.counts.get(object_type)
+        if count is None:
+            return self._send_json({'status': 'error', 'message': f"Unknown object type {object_type}"}, status=400)
+        since = None
+        for group in self.body.get('filterGroups') or []:
+            for f in group.get('filters') or []:
+                if f.get('operator') == 'GTE':
+                    since = datetime.fromtimestamp(int(f['value']) / 1000, timezone.utc)
+        # Unchanged objects were all modified long ago, so a search since a recent date only finds the changed ones
+        if since and since > self.portal.created_at(count) + timedelta(days=1):
+            ids = self.portal.changed_ids(object_type)
+        else:
+            ids = range(1, count + 1)
+        after = int(self.body.get('after') or 0)
+        limit = min(int(self.body.get('limit') or 10), 100)
+        if after >= SEARCH_MAX_RESULTS:
+            return self._send_json({'status': 'error', 'message': "Search results are limited to 10000."}, status=400)
+        properties = self.body.get('properties') or []
+        page = self._page(ids[after:after + limit], after, limit, len(ids),
+                          lambda i: self.portal.get_object(object_type, i, properties))
+        page['total'] = len(ids)
+        self._send_json(page)
+
+    def _get_owners(self):
+        after = int(self.query.get('after', ['0'])[0] or 0)
+        limit = min(int(self.query.get('limit', ['100'])[0]), 500)
+        ids = range(after + 1, min(after + limit, OWNERS) + 1)
+        self._send_json(self._page(ids, after, limit, OWNERS, self.portal.get_owner))
+
+    def _get_pipelines(self):
+        self._send_json({'results': self.portal.get_pipelines()})
+
+    def _read_associations(self, to_object_type: str):
+        if to_object_type not in ('contacts', 'companies', 'notes', 'emails'):
+            return self._send_json({'status': 'error', 'message': f"Unknown object type {to_object_type}"}, status=400)
+        association_type = f"ticket_to_{to_object_type[:-1] if to_object_type != 'companies' else 'company'}"
+        results = []
+        for ticket in self.body.get('inputs') or []:
+            ticket_id = int(ticket['id'])
+            if not 1 <= ticket_id <= self.portal.counts['tickets']:
+                continue
+            associated = self.portal.associated_ids(to_object_type, ticket_id)
+            if associated:
+                results.append({
+                    'from': {'id': str(ticket_id)},
+                    'to': [{'id': str(i), 'type': association_type} for i in associated],
+                })
+        now = _iso(datetime.now(timezone.utc))
+        self._send_json({'status': 'COMPLETE', 'results': results, 'startedAt': now, 'completedAt': now})
+
+    def _check_file(self, file_id: str) -> bool:
+        if 1 <= int(file_id) <= self.portal.counts['files']:
+            return True
+        self._send_json({'status': 'error', 'message': f"File {file_id} not found", 'category': 'OBJECT_NOT_FOUND'},
+                        status=404)
+        return False
+
+    def _get_file(self, file_id: str):
+        if self._check_file(file_id):
+            self._send_json(self.portal.get_file(int(file_id)))
+
+    def _get_signed_url(self, file_id: str):
+        if not self._check_file(file_id):
+            return
+        expiration = int(self.query.get('expirationSeconds', ['60'])[0])
+        host = self.headers.get('Host') or f"{self.server.server_address[0]}:{self.server.server_address[1]}"
+        self._send_json({
+            'url': f"http://{host}/_download/{file_id}",
+            'expiresAt': _iso(datetime.now(timezone.utc) + timedelta(seconds=expiration)),
+            'name': f"file-{file_id}",
+            'extension': 'pdf',
+            'type': 'DOCUMENT',
+            'size': self.portal.file_size,
+        })
+
+    def _download(self, file_id: str):
+        if not self._check_file(file_id):
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(self.portal.file_size))
+        self.end_headers()
+        for chunk in self.portal.file_chunks(int(file_id)):
+            self.wfile.write(chunk)
+
+
+def serve(portal: Portal, host: str = 'localhost', port: int = 8765, latency: float = 0.0,
+          error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Starts serving the portal on a background thread.
+
+    :param latency: The average delay added to each API call, in seconds.
+    :param error_rate: The share of API calls answered with 429 Too Many Requests.
+    :return: The server, to shut down when done.
+    """
+    handler = type('PortalHandler', (FakeHubSpotHandler,), {
+        'portal': portal,
+        'latency': latency,
+        'error_rate': error_rate,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=10000, help="Approximate number of CRM objects in the portal.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Average latency of the API calls, in ms.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of the API calls answered with 429.")
+    parser.add_argument('--attachment-share', type=float, default=0.1,
+                        help="Share of the notes and emails with attachments.")
+    parser.add_argument('--file-size', type=int, default=200 * 1024, help="Size of the files, in bytes.")
+    parser.add_argument('--changed-share', type=float, default=0.01,
+                        help="Share of the objects found changed by the incremental sync searches.")
+    args = parser.parse_args()
+    portal = Portal(args.objects, attachment_share=args.attachment_share, file_size=args.file_size,
+                    changed_share=args.changed_share)
+    server = serve(portal, args.host, args.port, args.latency / 1000, args.error_rate)
+    print(f"Serving a portal of {portal.counts} on http://{args.host}:{args.port}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
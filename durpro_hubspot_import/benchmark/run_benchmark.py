@@ -0,0 +1,178 @@
+"""Benchmarks the HubSpot import on synthetic portals served by the fake HubSpot server (see fake_hubspot.py).
+
+For each portal size, the template database (an Odoo database with durpro_hubspot_import installed and at least one
+helpdesk team) is copied, the fake server is started in a process of its own, and the import is run to completion by
+calling HubSpotAutoImporter.run_next() over and over, like the import scheduled action does. The pipelines imported are
+mapped to the first helpdesk team and its stages along the way, so that the tickets can be converted.
+
+The throughput of each phase is then reported from the import metrics recorded by the jobs (see
+HubSpotImportMetric), and optionally written to a JSON file.
+
+Usage:
+    python run_benchmark.py -c odoo.conf --template hubspot_bench --sizes 10000,100000,1000000 --latency 50
+"""
+from contextlib import closing
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.service import db
+from odoo.tools import config
+
+FAKE_HUBSPOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_hubspot.py')
+METRIC_COLUMNS = ['runs', 'duration', 'objects', 'api_calls', 'api_retries', 'throttled_seconds', 'db_queries',
+                  'db_seconds', 'megabytes_downloaded']
+
+
+def start_fake_hubspot(size: int, port: int, args) -> subprocess.Popen:
+    """Starts the fake HubSpot server for a portal of the given size and waits for it to accept connections."""
+    server = subprocess.Popen([sys.executable, FAKE_HUBSPOT, '--objects', str(size), '--port', str(port),
+                               '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+                               '--attachment-share', str(args.attachment_share),
+                               '--file-size', str(args.file_size)])
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        with closing(socket.socket()) as s:
+            if s.connect_ex(('localhost', port)) == 0:
+                return server
+        time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("The fake HubSpot server didn't start.")
+
+
+def prepare(env, port: int, sync: bool):
+    from odoo.addons.durpro_hubspot_import import constants
+    params = env['ir.config_parameter'].sudo()
+    params.set_param(constants.APPKEY_PARAM, 'benchmark')
+    params.set_param(constants.HS_API_HOST_PARAM, f"http://localhost:{port}")
+    params.set_param(constants.PAGE_SIZE_PARAM, '500')
+    params.set_param(constants.HS_INCREMENTAL_SYNC_PARAM, '1' if sync else False)
+
+
+def map_pipelines(env):
+    """Maps the imported pipelines and stages that aren't yet to the first helpdesk team and its stages."""
+    team = env['helpdesk.team'].search([('stage_ids', '!=', False)], limit=1)
+    if not team:
+        raise RuntimeError("The template database needs a helpdesk team with stages.")
+    stages = team.stage_ids
+    for pipeline in env['durpro_hubspot_import.hubspot_pipeline'].search([('helpdesk_team_id', '=', False)]):
+        pipeline.helpdesk_team_id = team
+    for index, stage in enumerate(env['durpro_hubspot_import.hubspot_pipeline_stage'].search(
+            [('helpdesk_stage', '=', False)], order='hs_pipeline_id, display_order')):
+        stage.helpdesk_stage = stages[index % len(stages)]
+
+
+def run_import(dbname: str, sync: bool, max_runs: int) -> int:
+    """Runs the import like its scheduled action until no job is left (and one sync cycle is done if sync).
+
+    :return: The number of runs.
+    """
+    registry = odoo.registry(dbname)
+    thread = threading.current_thread()
+    for run in range(1, max_runs + 1):
+        # Like the cron threads, so that run_next stops for time and the jobs can count their queries
+        thread.start_time = time.time()
+        thread.query_count = 0
+        thread.query_time = 0.0
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            map_pipelines(env)
+            env['durpro_hubspot_import.auto_importer'].run_next()
+            jobs = env['durpro_hubspot_import.import_job']
+            unfinished = jobs.search_count([('state', 'in', ('pending', 'running'))])
+            failed = jobs.search_count([('state', '=', 'failed')])
+            synced = jobs.search_count([('phase', '=', 'sync_create_tickets'), ('state', '=', 'done')])
+        print(f"  run {run}: {unfinished} jobs left, {failed} failed", flush=True)
+        if failed:
+            raise RuntimeError(f"Import jobs failed in {dbname}, see the Import Jobs menu.")
+        if not unfinished and (not sync or synced):
+            return run
+    raise RuntimeError(f"The import of {dbname} didn't complete in {max_runs} runs.")
+
+
+def collect_results(dbname: str) -> list:
+    """The metrics of each phase, in the order of the phases."""
+    from odoo.addons.durpro_hubspot_import.models.hubspot_import_job import JOB_PHASES
+    with odoo.registry(dbname).cursor() as cr:
+        cr.execute("""SELECT phase, count(*), sum(duration), sum(objects), sum(api_calls), sum(api_retries),
+                             sum(throttled_seconds), sum(db_queries), sum(db_seconds), sum(megabytes_downloaded)
+                      FROM durpro_hubspot_import_import_metric
+                      GROUP BY phase""")
+        rows = {row[0]: dict(zip(METRIC_COLUMNS, row[1:])) for row in cr.fetchall()}
+    results = []
+    for phase, label in JOB_PHASES:
+        if phase in rows:
+            row = rows[phase]
+            row.update(phase=phase, objects_per_second=row['objects'] / row['duration'] if row['duration'] else 0.0)
+            results.append(row)
+    return results
+
+
+def print_results(size: int, results: list, wall_seconds: float):
+    print(f"\nPortal of {size} objects, imported in {wall_seconds:.0f}s")
+    print(f"{'phase':<24}{'runs':>6}{'seconds':>10}{'objects':>10}{'obj/s':>10}{'calls':>8}{'429s':>6}"
+          f"{'throttled':>11}{'db s':>9}{'MB':>9}")
+    for row in results:
+        print(f"{row['phase']:<24}{row['runs']:>6}{row['duration']:>10.1f}{row['objects']:>10}"
+              f"{row['objects_per_second']:>10.1f}{row['api_calls']:>8}{row['api_retries']:>6}"
+              f"{row['throttled_seconds']:>11.1f}{row['db_seconds']:>9.1f}{row['megabytes_downloaded']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', required=True, help="The Odoo configuration file.")
+    parser.add_argument('--template', required=True, help="The database to copy for each portal size.")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="Comma separated portal sizes, in objects.")
+    parser.add_argument('--port', type=int, default=8765, help="The port of the fake HubSpot server.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Average latency of the API calls, in ms.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of the API calls answered with 429.")
+    parser.add_argument('--attachment-share', type=float, default=0.1,
+                        help="Share of the notes and emails with attachments.")
+    parser.add_argument('--file-size', type=int, default=200 * 1024, help="Size of the files, in bytes.")
+    parser.add_argument('--run-seconds', type=int, default=900,
+                        help="Time limit of each run, as limit_time_real for the scheduled action.")
+    parser.add_argument('--max-runs', type=int, default=1000)
+    parser.add_argument('--sync', action='store_true', help="Also run one incremental sync cycle after the import.")
+    parser.add_argument('--keep', action='store_true', help="Keep the benchmark databases.")
+    parser.add_argument('--output', help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    config.parse_config(['-c', args.config])
+    config['limit_time_real'] = args.run_seconds
+    odoo.service.server.load_server_wide_modules()
+    report = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        dbname = f"{args.template}_bench_{size}"
+        if dbname in db.list_dbs(True):
+            db.exp_drop(dbname)
+        db.exp_duplicate_database(args.template, dbname)
+        server = start_fake_hubspot(size, args.port, args)
+        try:
+            with odoo.registry(dbname).cursor() as cr:
+                prepare(api.Environment(cr, SUPERUSER_ID, {}), args.port, args.sync)
+            print(f"Importing a portal of {size} objects into {dbname}", flush=True)
+            started = time.time()
+            runs = run_import(dbname, args.sync, args.max_runs)
+            wall_seconds = time.time() - started
+            results = collect_results(dbname)
+        finally:
+            server.terminate()
+            server.wait()
+        print_results(size, results, wall_seconds)
+        report[size] = {'runs': runs, 'wall_seconds': wall_seconds, 'phases': results}
+        if not args.keep:
+            db.exp_drop(dbname)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
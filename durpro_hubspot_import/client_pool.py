@@ -0,0 +1,103 @@
+from . import constants
+from . import metrics
+from .rate_limiter import rate_limited_api_factory
+from hubspot import HubSpot
+import certifi
+import hashlib
+import threading
+import urllib3
+
+# One keep-alive connection pool per worker process, shared by the HubSpot SDK calls and the signed URL downloads.
+# 429 responses are left to the rate limiter rather than retried by urllib3, so that the wait is accounted for.
+pool_manager = urllib3.PoolManager(num_pools=constants.HTTP_NUM_POOLS, maxsize=constants.HTTP_POOL_MAXSIZE,
+                                   cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(),
+                                   retries=urllib3.Retry(3, respect_retry_after_header=False))
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class PooledApiFactory:
+    """api_factory for the HubSpot client that builds each generated API (and its ApiClient) only once, wires it to the
+    shared connection pool and sends its requests through the rate limiter.
+
+    The HubSpot discovery classes call the api_factory every time an API is accessed (e.g. client.crm.objects.basic_api),
+    so without this every call would build a new ApiClient with its own connection pool and TLS handshake.
+
+    The APIs are pointed at host instead of the HubSpot API if given."""
+
+    def __init__(self, host: str = None):
+        self.host = host
+        self._apis = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, api_client_package, api_name, config):
+        key = (api_client_package.__name__, api_name)
+        with self._lock:
+            api = self._apis.get(key)
+            if api is None:
+                api = rate_limited_api_factory(api_client_package, api_name, config)
+                api.api_client.rest_client.pool_manager.clear()
+                api.api_client.rest_client.pool_manager = pool_manager
+                if self.host:
+                    api.api_client.configuration.host = self.host
+                self._apis[key] = api
+        return api
+
+
+def get_client(access_token: str, host: str = None) -> HubSpot:
+    """Returns the HubSpot client of this worker process for the given access token and API host (the HubSpot API by
+    default). Clients built for a previous access token or host are dropped, so changing the app key in the settings
+    is enough to invalidate them."""
+    with _clients_lock:
+        client = _clients.get((access_token, host))
+        if client is None:
+            _clients.clear()
+            client = _clients[(access_token, host)] = HubSpot(access_token=access_token,
+                                                              api_factory=PooledApiFactory(host))
+        return client
+
+
+def invalidate_clients():
+    with _clients_lock:
+        _clients.clear()
+
+
+class DownloadError(Exception):
+    """Raised when a file download is answered with an HTTP error status, e.g. for an expired signed URL."""
+
+
+def _check_status(response, url: str):
+    if response.status >= 400:
+        raise DownloadError(f"Downloading {url} failed with HTTP status {response.status}.")
+
+
+def download(url: str) -> bytes:
+    """Downloads the file at url (typically a HubSpot signed URL) over the shared connection pool.
+
+    :raise DownloadError: if the server answers with an error status.
+    """
+    response = pool_manager.request('GET', url, redirect=True)
+    _check_status(response, url)
+    data = response.data
+    metrics.add('bytes_downloaded', len(data))
+    return data
+
+
+def download_to(url: str, fileobj) -> str:
+    """Streams the file at url to fileobj by chunks, so that large files never have to fit in memory.
+
+    :return: The SHA-1 checksum of the contents, as used by the Odoo filestore.
+    :raise DownloadError: if the server answers with an error status, before anything is written to fileobj.
+    """
+    response = pool_manager.request('GET', url, redirect=True, preload_content=False)
+    sha = hashlib.sha1()
+    try:
+        _check_status(response, url)
+        for chunk in response.stream(constants.DOWNLOAD_CHUNK_SIZE):
+            sha.update(chunk)
+            fileobj.write(chunk)
+            metrics.add('bytes_downloaded', len(chunk))
+    finally:
+        response.release_conn()
+    return sha.hexdigest()
@@ -1,4 +1,24 @@
 APPKEY_PARAM = 'durpro_hubspot_sync.app_key'
 PAGE_SIZE_PARAM = 'durpro_hubspot_sync.page_size'
 HS_AUTO_IMPORT_PARAM = 'durpro_hubspot_sync.hs_auto_import'
+# Overrides the HubSpot API host, e.g. to run the import against benchmark/fake_hubspot.py
+HS_API_HOST_PARAM = 'durpro_hubspot_sync.api_host'
 BASE_FIELDS = {'id', '__last_update', 'display_name', 'create_uid', 'create_date', 'write_uid', 'write_date'}
+ATTACHMENT_DOWNLOAD_WORKERS = 4
+# Attachments are downloaded to the filestore by chunks of this size, so that they never have to fit in memory
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Processes sanitizing the email bodies before they are posted to the chatter
+HTML_SANITIZE_PROCESSES = 4
+HS_CALLS_PER_SECOND = 10
+HS_CALLS_PER_DAY = 250000
+HTTP_NUM_POOLS = 10
+HTTP_POOL_MAXSIZE = 8
+HS_SEARCH_CALLS_PER_SECOND = 4
+HS_SEARCH_MAX_RESULTS = 10000
+# Maximum number of objects whose associations can be read in one call
+HS_ASSOCIATION_BATCH_SIZE = 1000
+HS_INCREMENTAL_SYNC_PARAM = 'durpro_hubspot_sync.hs_incremental_sync'
+HS_JOB_MAX_ATTEMPTS = 3
+HS_JOB_RETENTION_DAYS = 30
+# Advisory lock key taken while enqueuing import jobs
+HS_JOB_ENQUEUE_LOCK = 48110915
@@ -0,0 +1,37 @@
+from odoo import fields
+from psycopg2.extras import Json as PsycopgJson
+import copy
+import json
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
+
+
+class Jsonb(fields.Field):
+    """Stores a JSON document (dict or list) in a Postgres jsonb column, so that its values can be read with the json
+    operators in SQL (e.g. contents->'properties'->>'subject'). Values that aren't JSON types, such as the datetimes of
+    the HubSpot SDK objects, are stored as strings."""
+    type = 'jsonb'
+    column_type = ('jsonb', 'jsonb')
+
+    def convert_to_column(self, value, record, values=None, validate=True):
+        if not value:
+            return None
+        return PsycopgJson(value, dumps=_dumps)
+
+    def convert_to_cache(self, value, record, validate=True):
+        if not value:
+            return None
+        if isinstance(value, str):
+            return json.loads(value)
+        # Values read from the database are already decoded by psycopg2
+        return json.loads(_dumps(value)) if validate else value
+
+    def convert_to_record(self, value, record):
+        return False if value is None else copy.deepcopy(value)
+
+    def convert_to_export(self, value, record):
+        if not value:
+            return ''
+        return _dumps(value)
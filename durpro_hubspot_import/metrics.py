@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+_local = threading.local()
+
+COUNTERS = ('objects', 'api_calls', 'api_retries', 'throttled_seconds', 'bytes_downloaded')
+
+
+class Metrics:
+    """Counters of the work done by an import job, filled by the code it runs through add(). The collector is bound to
+    the thread running the job, and to the download threads it starts through bind()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = time.time()
+        self.duration = 0.0
+        thread = threading.current_thread()
+        self._query_count = getattr(thread, 'query_count', 0)
+        self._query_time = getattr(thread, 'query_time', 0.0)
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def add(self, counter: str, value=1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def stop(self):
+        self.duration = time.time() - self.started
+        # Odoo counts the queries and their duration on the thread running them
+        thread = threading.current_thread()
+        self.db_queries = getattr(thread, 'query_count', 0) - self._query_count
+        self.db_seconds = getattr(thread, 'query_time', 0.0) - self._query_time
+
+
+@contextmanager
+def collect():
+    """Collects the metrics of the code run in the with block, on this thread."""
+    metrics = Metrics()
+    previous = getattr(_local, 'metrics', None)
+    _local.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        metrics.stop()
+        _local.metrics = previous
+
+
+def add(counter: str, value=1):
+    """Adds value to a counter of the metrics being collected on this thread, if any."""
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        metrics.add(counter, value)
+
+
+def bind(func):
+    """Wraps func so that it adds to the metrics being collected on this thread when run on another thread."""
+    metrics = getattr(_local, 'metrics', None)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'metrics', None)
+        _local.metrics = metrics
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.metrics = previous
+    return wrapper
@@ -0,0 +1,83 @@
+# Removes the duplicate HubSpot records before the unique constraints on the HubSpot ids are added, keeping the oldest
+# record of each HubSpot id. References to the removed records (foreign keys, Many2many relation rows and the files
+# attached to them) are moved to the kept ones first.
+
+# (table, unique columns, [(referencing table, referencing column, other column of a Many2many relation table)])
+DEDUPLICATIONS = [
+    ('durpro_hubspot_import_hubspot_pipeline', ['hs_pipeline_id'], [
+        ('durpro_hubspot_import_hubspot_pipeline_stage', 'hs_pipeline_id', None),
+        ('durpro_hubspot_import_hubspot_ticket', 'pipeline', None),
+    ]),
+    ('durpro_hubspot_import_hubspot_pipeline_stage', ['hs_stage_id', 'hs_pipeline_id'], [
+        ('durpro_hubspot_import_hubspot_ticket', 'pipeline_stage', None),
+    ]),
+    ('durpro_hubspot_import_hubspot_ticket', ['hs_ticket_id'], [
+        ('helpdesk_ticket', 'hubspot_ticket_id', None),
+        ('durpro_hubspot_import_ticket_contact_rel', 'hs_ticket_id', 'hs_object_id'),
+        ('durpro_hubspot_import_ticket_company_rel', 'hs_ticket_id', 'hs_object_id'),
+        ('durpro_hubspot_import_ticket_email_rel', 'hs_ticket_id', 'hs_object_id'),
+        ('durpro_hubspot_import_ticket_note_rel', 'hs_ticket_id', 'hs_object_id'),
+    ]),
+    ('durpro_hubspot_import_hubspot_contact', ['hs_object_id'], [
+        ('durpro_hubspot_import_ticket_contact_rel', 'hs_object_id', 'hs_ticket_id'),
+    ]),
+    ('durpro_hubspot_import_hubspot_company', ['hs_object_id'], [
+        ('durpro_hubspot_import_ticket_company_rel', 'hs_object_id', 'hs_ticket_id'),
+    ]),
+    ('durpro_hubspot_import_hubspot_note', ['hs_object_id'], [
+        ('durpro_hubspot_import_ticket_note_rel', 'hs_object_id', 'hs_ticket_id'),
+    ]),
+    ('durpro_hubspot_import_hubspot_email', ['hs_id'], [
+        ('durpro_hubspot_import_ticket_email_rel', 'hs_object_id', 'hs_ticket_id'),
+    ]),
+    ('durpro_hubspot_import_hubspot_attachment', ['hs_id'], []),
+    ('durpro_hubspot_import_hubspot_owner', ['hs_id'], [
+        ('durpro_hubspot_import_hubspot_ticket', 'associated_owner', None),
+        ('durpro_hubspot_import_hubspot_email', 'owner', None),
+        ('durpro_hubspot_import_hubspot_note', 'owner', None),
+    ]),
+]
+
+# The models of the tables whose records have files attached (ir_attachment.res_model)
+ATTACHMENT_MODELS = {
+    'durpro_hubspot_import_hubspot_note': 'durpro_hubspot_import.hubspot_note',
+    'durpro_hubspot_import_hubspot_email': 'durpro_hubspot_import.hubspot_email',
+}
+
+
+def _column_exists(cr, table, column):
+    cr.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s", (table, column))
+    return bool(cr.fetchone())
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    for table, columns, references in DEDUPLICATIONS:
+        partition = ", ".join(columns)
+        cr.execute(f"""CREATE TEMP TABLE hs_duplicates AS
+                       SELECT id, keeper_id FROM (
+                           SELECT id, min(id) OVER (PARTITION BY {partition}) AS keeper_id
+                           FROM {table}
+                           WHERE {" AND ".join(f"{c} IS NOT NULL" for c in columns)}) d
+                       WHERE id != keeper_id""")
+        for ref_table, ref_column, other_column in references:
+            if not _column_exists(cr, ref_table, ref_column):
+                continue
+            if other_column:
+                # The relation rows of the duplicates are copied to the keeper unless it has them already, then
+                # deleted, so that no (ticket, target) pair is left twice
+                cr.execute(f"""INSERT INTO {ref_table} ({ref_column}, {other_column})
+                               SELECT DISTINCT d.keeper_id, r.{other_column}
+                               FROM {ref_table} r JOIN hs_duplicates d ON r.{ref_column} = d.id
+                               ON CONFLICT DO NOTHING""")
+                cr.execute(f"DELETE FROM {ref_table} r USING hs_duplicates d WHERE r.{ref_column} = d.id")
+            else:
+                cr.execute(f"""UPDATE {ref_table} r SET {ref_column} = d.keeper_id
+                               FROM hs_duplicates d WHERE r.{ref_column} = d.id""")
+        if table in ATTACHMENT_MODELS:
+            cr.execute("""UPDATE ir_attachment a SET res_id = d.keeper_id
+                          FROM hs_duplicates d WHERE a.res_model = %s AND a.res_id = d.id""",
+                       (ATTACHMENT_MODELS[table],))
+        cr.execute(f"DELETE FROM {table} t USING hs_duplicates d WHERE t.id = d.id")
+        cr.execute("DROP TABLE hs_duplicates")
@@ -0,0 +1,29 @@
+# Converts the JSON contents of the HubSpot records to jsonb, and removes from the emails' contents the bodies that are
+# already stored in their own fields.
+
+TABLES = [
+    'durpro_hubspot_import_hubspot_ticket',
+    'durpro_hubspot_import_hubspot_contact',
+    'durpro_hubspot_import_hubspot_company',
+    'durpro_hubspot_import_hubspot_note',
+    'durpro_hubspot_import_hubspot_email',
+    'durpro_hubspot_import_hubspot_attachment',
+    'durpro_hubspot_import_hubspot_owner',
+    'durpro_hubspot_import_hubspot_pipeline',
+]
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    for table in TABLES:
+        cr.execute("""SELECT data_type FROM information_schema.columns
+                      WHERE table_name = %s AND column_name = 'contents'""", (table,))
+        row = cr.fetchone()
+        if not row or row[0] == 'jsonb':
+            continue
+        cr.execute(f"""ALTER TABLE {table} ALTER COLUMN contents TYPE jsonb
+                       USING NULLIF(contents, '')::jsonb""")
+    cr.execute("""UPDATE durpro_hubspot_import_hubspot_email
+                  SET contents = contents #- '{properties,hs_email_html}' #- '{properties,hs_email_text}'
+                  WHERE contents->'properties' ?| array['hs_email_html', 'hs_email_text']""")
@@ -0,0 +1,39 @@
+# Converts the state of the 1.0 auto import controller, which ran the import phases one after the other, to import
+# jobs, so that an import in progress resumes where it stopped.
+
+IMPORT_ORDER = ['pipelines', 'owners', 'tickets', 'contacts', 'companies', 'notes', 'emails', 'associate_contacts',
+                'associate_companies', 'associate_emails', 'associate_notes', 'note_attachments', 'email_attachments',
+                'create_tickets']
+# The phases whose 1.0 paging token ("after") is still their cursor. The offsets of the other phases can't be used as
+# id cursors, so these simply restart.
+AFTER_TOKEN_PHASES = {'tickets', 'contacts', 'companies', 'notes', 'emails'}
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    from odoo import api, SUPERUSER_ID
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    if env['durpro_hubspot_import.import_job'].search_count([]):
+        return
+    cr.execute("SELECT next_import, after FROM durpro_hubspot_import_auto_importer ORDER BY id LIMIT 1")
+    row = cr.dictfetchone()
+    if not row or not row['next_import']:
+        return
+    cursor = row['after'] if row['next_import'] in AFTER_TOKEN_PHASES else False
+    # The phases before the next one are done, all of them if the import was complete ('stop')
+    jobs = []
+    done = True
+    for phase in IMPORT_ORDER:
+        if phase == row['next_import']:
+            done = False
+        vals = {'phase': phase, 'state': 'done' if done else 'pending'}
+        if phase == row['next_import'] and cursor:
+            vals['cursor'] = cursor
+        jobs.append(vals)
+    env['durpro_hubspot_import.import_job'].create(jobs)
+
+    # The additional workers follow the main scheduled action
+    controller = env['durpro_hubspot_import.auto_importer'].search([], limit=1)
+    if controller.action_id.active:
+        controller.worker_action_ids.active = True
@@ -0,0 +1,23 @@
+# Converts the HubSpot creation dates from their raw ISO 8601 strings to timestamp columns (naive UTC, as Odoo stores
+# datetimes), so that the ORM doesn't replace the columns and lose their values. Malformed values are dropped.
+
+COLUMNS = [
+    ('durpro_hubspot_import_hubspot_ticket', 'createdate'),
+    ('durpro_hubspot_import_hubspot_note', 'hs_created_date'),
+    ('durpro_hubspot_import_hubspot_email', 'hs_createdate'),
+    ('durpro_hubspot_import_hubspot_attachment', 'created_at'),
+]
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    for table, column in COLUMNS:
+        cr.execute("""SELECT data_type FROM information_schema.columns
+                      WHERE table_name = %s AND column_name = %s""", (table, column))
+        row = cr.fetchone()
+        if not row or row[0] != 'character varying':
+            continue
+        cr.execute(f"""ALTER TABLE {table} ALTER COLUMN {column} TYPE timestamp
+                       USING CASE WHEN {column} ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}}[T ]\\d{{2}}:\\d{{2}}'
+                                  THEN {column}::timestamptz AT TIME ZONE 'UTC' END""")
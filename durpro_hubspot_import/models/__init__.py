@@ -9,3 +9,5 @@ from . import hubspot_note
 from . import hubspot_owner
 from . import hubspot_attachment
 from . import hubspot_auto_import
+from . import hubspot_import_job
+from . import hubspot_import_metric
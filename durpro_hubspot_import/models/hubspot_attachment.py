@@ -1,9 +1,15 @@
 from odoo import models, fields, api, _
-import requests
-import json
+from odoo.tools.mimetypes import guess_mimetype
+from ..client_pool import DownloadError, download, download_to
 import logging
+import mimetypes
+import os
+import tempfile
 from hubspot.files.files.exceptions import ApiException
 
+_logger = logging.getLogger(__name__)
+
+
 class HubSpotAttachment(models.Model):
     _inherit = "durpro_hubspot_import.hubspot_model"
     _name = "durpro_hubspot_import.hubspot_attachment"
@@ -11,12 +17,20 @@ class HubSpotAttachment(models.Model):
 
     hubspot_model_name = "files"
     hubspot_id_field = "hs_id"
+    hubspot_local_fields = ('checksum', 'file_size')
+
+    _sql_constraints = [
+        ('hs_id_unique', 'unique(hs_id)', 'A HubSpot file can only be imported once.'),
+    ]
 
-    hs_id = fields.Char("HS ID", compute="_extract_hs_fields", store=True)
-    name = fields.Char("HS File Name", compute="_extract_hs_fields", store=True)
-    extension = fields.Char("HS File Extension", compute="_extract_hs_fields", store=True)
-    created_at = fields.Char("Creation Time", compute="_extract_hs_fields", store=True)
-    type = fields.Char("File Type", compute="_extract_hs_fields", store=True)
+    hs_id = fields.Char("HS ID", readonly=True)
+    name = fields.Char("HS File Name", readonly=True)
+    extension = fields.Char("HS File Extension", readonly=True)
+    created_at = fields.Datetime("Creation Time", readonly=True)
+    type = fields.Char("File Type", readonly=True)
+    checksum = fields.Char("Checksum", readonly=True, index=True,
+                           help="SHA-1 of the downloaded contents, which are stored in the filestore under it.")
+    file_size = fields.Integer("Downloaded Size", readonly=True)
 
     @api.model
     def import_all(self):
@@ -30,17 +44,116 @@ class HubSpotAttachment(models.Model):
             file_metadata = self._api_client().files.files.files_api.get_by_id(file_id=file_id).to_dict()
         except ApiException:
             return False
-        contents = json.dumps(file_metadata, default=str)
-        r = self.env[self._name].create({'contents': contents})
-        return r
+        return self._store_hs_objects([file_metadata], update=True)
+
+    @api.model
+    def fetch_file(self, client, file_id, directory: str):
+        """Fetches the metadata of a HubSpot file and streams its contents to a temporary file without touching the
+        database, so that it can be called from a download thread.
+
+        :param client: The HubSpot API client to use for the metadata and signed URL calls.
+        :param file_id: The HubSpot file ID.
+        :param directory: The directory in which to create the temporary file.
+        :return: A (file metadata dict, temporary file path, checksum) tuple, or False if the file is not found on
+            HubSpot servers or can't be downloaded from its signed URL.
+        """
+        files_api = client.files.files.files_api
+        try:
+            file_metadata = files_api.get_by_id(file_id=file_id).to_dict()
+            signed_url = files_api.get_signed_url(file_id=file_id, expiration_seconds=60).to_dict()
+        except ApiException:
+            return False
+        fd, path = tempfile.mkstemp(prefix='hubspot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                checksum = download_to(signed_url['url'], f)
+        except DownloadError as e:
+            os.unlink(path)
+            _logger.warning(f"Skipping HubSpot file {file_id}: {e}")
+            return False
+        except Exception:
+            os.unlink(path)
+            raise
+        return file_metadata, path, checksum
+
+    @api.model
+    def _get_stored_files(self, file_ids) -> dict:
+        """The ir.attachment values of the HubSpot files already downloaded to the filestore, by HubSpot file id, so
+        that they are attached again without being downloaded."""
+        if self.env['ir.attachment']._storage() != 'file':
+            return {}
+        res = {}
+        for hs_file in self.search([('hs_id', 'in', list(set(file_ids))), ('checksum', '!=', False)]):
+            fname = self._store_fname(hs_file.checksum)
+            # The file may have been garbage collected since, if no attachment used it anymore
+            if os.path.isfile(self.env['ir.attachment']._full_path(fname)):
+                res[hs_file.hs_id] = hs_file._get_attachment_vals(fname)
+        return res
+
+    @api.model
+    def _store_files(self, downloads) -> dict:
+        """Records the metadata of downloaded files and moves their contents to the filestore, where files with the
+        same contents are only stored once.
+
+        :param downloads: (file metadata dict, temporary file path, checksum) tuples as returned by fetch_file.
+        :return: The ir.attachment values of the files, by HubSpot file id.
+        """
+        if not downloads:
+            return {}
+        attachment_model = self.env['ir.attachment']
+        files = {f.hs_id: f for f in self._store_hs_objects([metadata for metadata, _path, _sum in downloads],
+                                                            update=True)}
+        res = {}
+        for metadata, path, checksum in downloads:
+            hs_file = files[str(metadata['id'])]
+            hs_file.write({'checksum': checksum, 'file_size': os.path.getsize(path)})
+            if attachment_model._storage() != 'file':
+                with open(path, 'rb') as f:
+                    res[hs_file.hs_id] = hs_file._get_attachment_vals(raw=f.read())
+                os.unlink(path)
+                continue
+            fname = self._store_fname(checksum)
+            full_path = attachment_model._full_path(fname)
+            if os.path.isfile(full_path):
+                os.unlink(path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(path, full_path)
+            # Like ir.attachment._file_write, so that the file is removed if the transaction is rolled back
+            attachment_model._mark_for_gc(fname)
+            res[hs_file.hs_id] = hs_file._get_attachment_vals(fname)
+        return res
+
+    @api.model
+    def _store_fname(self, checksum: str) -> str:
+        return checksum[:2] + '/' + checksum
+
+    def _get_attachment_vals(self, store_fname=None, raw=None) -> dict:
+        """The ir.attachment values of this file, either stored in the filestore as store_fname or with its raw
+        contents. Filestore attachments are created without their contents, so that they don't need to be read."""
+        self.ensure_one()
+        vals = {'name': self.name or self.extension or ""}
+        if raw is not None:
+            vals['raw'] = raw
+            return vals
+        mimetype = mimetypes.guess_type(f"file.{self.extension}")[0] if self.extension else None
+        if not mimetype:
+            with open(self.env['ir.attachment']._full_path(store_fname), 'rb') as f:
+                mimetype = guess_mimetype(f.read(1024))
+        vals.update({
+            'store_fname': store_fname,
+            'checksum': self.checksum,
+            'file_size': self.file_size,
+            'mimetype': mimetype,
+        })
+        return vals
 
     @api.depends('name', 'extension')
     def get_data(self):
         """Retrieves the file data from HubSpot servers using a signed_url."""
         signed_url = self._api_client().files.files.files_api.get_signed_url(file_id=self.hs_id,
                                                                              expiration_seconds=60).to_dict()
-        r = requests.get(signed_url['url'], allow_redirects=True)
-        return r.content
+        return download(signed_url['url'])
     @api.depends('name', 'extension')
     def get_filename(self):
         self.ensure_one()
@@ -1,14 +1,26 @@
 from odoo import models, fields, api, _
 from odoo.tools import config, plaintext2html
-from lxml import etree
+from concurrent.futures import ThreadPoolExecutor
 import threading
+import shutil
+import tempfile
+from typing import Tuple
 import time
 from .. import constants
+from .. import metrics
+from ..rate_limiter import DailyLimitReached, hubspot_rate_limiter, hubspot_search_rate_limiter
 import logging
-from PIL import UnidentifiedImageError
 
 _logger = logging.getLogger(__name__)
 
+# Creates helpdesk tickets without tracking messages, follower subscriptions or the resulting notifications
+NO_MAIL_CONTEXT = {
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+}
+
 
 class HubSpotAutoImporter(models.Model):
     _name = "durpro_hubspot_import.auto_importer"
@@ -16,135 +28,67 @@ class HubSpotAutoImporter(models.Model):
 
     action_id = fields.Many2one("ir.cron", string="Scheduled Action")
     active = fields.Boolean(string="Active", related="action_id.active")
-    tickets_imported = fields.Integer(string="HubSpot Tickets Imported", compute="_compute_import_totals")
-    contacts_imported = fields.Integer(string="HubSpot Contacts Imported", compute="_compute_import_totals")
-    companies_imported = fields.Integer(string="HubSpot Companies Imported", compute="_compute_import_totals")
-    pipelines_imported = fields.Integer(string="HubSpot Pipelines Imported", compute="_compute_import_totals")
-    emails_imported = fields.Integer(string="HubSpot Emails Imported", compute="_compute_import_totals")
-    notes_imported = fields.Integer(string="HubSpot Notes Imported", compute="_compute_import_totals")
-    owners_imported = fields.Integer(string="HubSpot Owners Imported", compute="_compute_import_totals")
-    attachments_imported = fields.Integer(string="HubSpot Attachments Imported", compute="_compute_import_totals")
-    attachments_remaining = fields.Integer(string="Attachments Remaining", compute="_compute_import_totals")
-    tickets_converted = fields.Integer(string="Tickets Converted", compute="_compute_import_totals")
+    # The import totals are refreshed at the end of each import phase (see _refresh_import_totals), so that showing
+    # them doesn't scan the imported tables
+    tickets_imported = fields.Integer(string="HubSpot Tickets Imported", readonly=True)
+    contacts_imported = fields.Integer(string="HubSpot Contacts Imported", readonly=True)
+    companies_imported = fields.Integer(string="HubSpot Companies Imported", readonly=True)
+    pipelines_imported = fields.Integer(string="HubSpot Pipelines Imported", readonly=True)
+    emails_imported = fields.Integer(string="HubSpot Emails Imported", readonly=True)
+    notes_imported = fields.Integer(string="HubSpot Notes Imported", readonly=True)
+    owners_imported = fields.Integer(string="HubSpot Owners Imported", readonly=True)
+    attachments_imported = fields.Integer(string="HubSpot Attachments Imported", readonly=True)
+    attachments_remaining = fields.Integer(string="Attachments Remaining", readonly=True)
+    tickets_converted = fields.Integer(string="Tickets Converted", readonly=True)
+    totals_refreshed_at = fields.Datetime(string="Totals Refreshed At", readonly=True)
 
     ticket_page_size = fields.Integer(string="Ticket Page Size", compute="_compute_page_size")
 
-    next_import = fields.Selection(string="Next Import Action", selection=[
-        ('pipelines', 'Pipelines'),
-        ('owners', 'Owners'),
-        ('tickets', 'Tickets'),
-        ('contacts', 'Contacts'),
-        ('companies', 'Companies'),
-        ('notes', 'Notes'),
-        ('emails', 'Emails'),
-        ('associate_contacts', 'Contact Associations'),
-        ('associate_companies', 'Company Associations'),
-        ('associate_emails', 'Email Associations'),
-        ('associate_notes', 'Note Associations'),
-        ('note_attachments', 'Note Attachments'),
-        ('email_attachments', 'Email Attachments'),
-        ('create_tickets', 'Create Tickets'),
-        ('stop', 'Done')
-    ], required=False)
-
-    after = fields.Char(string="After Token", help="Token for fetching the next page of results when interrupted.")
-    next_offset = fields.Integer(string="Next Offset", help="Offset integer to feed to association getters.")
+    worker_action_ids = fields.Many2many("ir.cron", string="Additional Workers",
+                                         help="Scheduled actions running import jobs in parallel with the main one.")
+    metric_ids = fields.One2many("durpro_hubspot_import.import_metric", "controller_id", string="Job Metrics")
 
     def _compute_page_size(self):
         self.ticket_page_size = self.env['ir.config_parameter'].sudo().get_param(constants.PAGE_SIZE_PARAM)
 
     @api.depends('action_id')
     def activate(self):
-        self.action_id.active = True
+        (self.action_id | self.worker_action_ids).active = True
 
     @api.depends('action_id')
     def deactivate(self):
         if not self.action_id:
             return
-        self.action_id.active = False
+        (self.action_id | self.worker_action_ids).active = False
 
     @api.model
     def run_next(self):
-        controller = self.env[self._name].search([('active', 'in', (True, False))], limit=1)
-        if controller.next_import == 'stop':
-            return
-        if controller.next_import == 'pipelines':
-            self.env['durpro_hubspot_import.hubspot_pipeline'].import_all()
-            controller.next_import = 'owners'
-        if controller.next_import == 'owners':
-            if not controller._check_time(30):
-                return
-            self.env['durpro_hubspot_import.hubspot_owner'].import_all()
-            controller.next_import = 'tickets'
-        if controller.next_import == 'tickets':
-            controller.after = self.env['durpro_hubspot_import.hubspot_ticket'].import_all(controller.after or None)
-            if controller.after:
-                return
-            controller.next_import = 'contacts'
-        if controller.next_import == 'contacts':
-            controller.after = self.env['durpro_hubspot_import.hubspot_contact'].import_all(controller.after or None)
-            if controller.after:
-                return
-            controller.next_import = 'companies'
-        if controller.next_import == 'companies':
-            controller.after = self.env['durpro_hubspot_import.hubspot_company'].import_all(controller.after or None)
-            if controller.after:
-                return
-            controller.next_import = 'notes'
-        if controller.next_import == 'notes':
-            controller.after = self.env['durpro_hubspot_import.hubspot_note'].import_all(controller.after or None)
-            if controller.after:
-                return
-            controller.next_import = 'emails'
-        if controller.next_import == 'emails':
-            controller.after = self.env['durpro_hubspot_import.hubspot_email'].import_all(controller.after or None)
-            if controller.after:
-                return
-            controller.next_import = 'associate_contacts'
-        if controller.next_import == 'associate_contacts':
-            controller.next_offset = self.env['durpro_hubspot_import.hubspot_ticket'].import_associated_contacts(
-                controller.next_offset)
-            if not controller.next_offset:
-                controller.next_import = 'associate_companies'
-            else:
-                return
-        if controller.next_import == 'associate_companies':
-            controller.next_offset = self.env['durpro_hubspot_import.hubspot_ticket'].import_associated_companies(
-                controller.next_offset)
-            if not controller.next_offset:
-                controller.next_import = 'associate_emails'
-            else:
-                return
-        if controller.next_import == 'associate_emails':
-            controller.next_offset = self.env['durpro_hubspot_import.hubspot_ticket'].import_associated_emails(
-                controller.next_offset)
-            if not controller.next_offset:
-                controller.next_import = 'associate_notes'
-            else:
-                return
-        if controller.next_import == 'associate_notes':
-            controller.next_offset = self.env['durpro_hubspot_import.hubspot_ticket'].import_associated_notes(
-                controller.next_offset)
-            if not controller.next_offset:
-                controller.next_import = 'note_attachments'
-            else:
-                return
-        if controller.next_import == 'note_attachments':
-            # No time check here since the _get_attachments method handles that
-            if not controller._get_attachments('durpro_hubspot_import.hubspot_note'):
-                _logger.info("Stopped short of processing all note attachments. Will restart later.")
-                return
-            controller.next_import = 'email_attachments'
-        if controller.next_import == 'email_attachments':
-            # No time check here since the _get_attachments method handles that
-            if not controller._get_attachments('durpro_hubspot_import.hubspot_email'):
-                _logger.info("Stopped short of processing all email attachments. Will restart later.")
-                return
-            controller.next_import = 'create_tickets'
-        if controller.next_import == 'create_tickets':
-            if not controller.create_odoo_tickets():
-                return
-            controller.next_import = 'stop'
+        """Entry point of the import scheduled actions, which may run it in parallel: enqueues the import jobs due, then
+        claims and runs jobs until none is ready or the time limit is near (see HubSpotImportJob)."""
+        jobs = self.env['durpro_hubspot_import.import_job']
+        self._share_rate_limits()
+        try:
+            jobs._enqueue()
+            while self._check_time(60):
+                job = jobs._claim()
+                if not job:
+                    break
+                job._run()
+        except DailyLimitReached as e:
+            _logger.warning(f"{e} Stopping the HubSpot import until the next run.")
+
+    @api.model
+    def _share_rate_limits(self):
+        """Gives this process its share of the HubSpot rate limits. In multi-process mode (workers > 0), the import
+        scheduled actions can run in as many cron processes as there are active ones, and each process has rate
+        limiters of its own, so the budget is split between them. In threaded mode, the cron threads all share this
+        process's limiters, which already keep them within the budget together, so it is not split."""
+        shares = 1
+        if config['workers'] > 0:
+            controller = self.search([('active', 'in', (True, False))], limit=1)
+            shares = len((controller.action_id | controller.worker_action_ids).filtered('active'))
+        hubspot_rate_limiter.set_share(shares)
+        hubspot_search_rate_limiter.set_share(shares)
 
     @api.model
     def _check_time(self, delay: int) -> bool:
@@ -158,96 +102,136 @@ class HubSpotAutoImporter(models.Model):
         else:
             return False
 
-    def _compute_import_totals(self):
-        self.ensure_one()
-        self.tickets_imported = self.env['durpro_hubspot_import.hubspot_ticket'].search_count([])
-        self.contacts_imported = self.env['durpro_hubspot_import.hubspot_contact'].search_count([])
-        self.companies_imported = self.env['durpro_hubspot_import.hubspot_company'].search_count([])
-        self.pipelines_imported = self.env['durpro_hubspot_import.hubspot_contact'].search_count([])
-        self.emails_imported = self.env['durpro_hubspot_import.hubspot_email'].search_count([])
-        self.notes_imported = self.env['durpro_hubspot_import.hubspot_note'].search_count([])
-        self.owners_imported = self.env['durpro_hubspot_import.hubspot_owner'].search_count([])
-        self.attachments_imported = self.env['durpro_hubspot_import.hubspot_attachment'].search_count([])
-        self.tickets_converted = self.env['helpdesk.ticket'].search_count([('hubspot_ticket_id', '!=', False)])
-        sql = """SELECT hs_attachment_ids 
-                             FROM (select hs_attachment_ids from durpro_hubspot_import_hubspot_note) note 
-                             UNION (select hs_attachment_ids from durpro_hubspot_import_hubspot_email)"""
-        self.env.cr.execute(sql)
-        result = self.env.cr.fetchall()
-        all_attachment_ids = set()
-        for r in result:
-            ids = str.split(r[0]) if r[0] else None
-            if ids:
-                for i in ids:
-                    all_attachment_ids.add(i)
-        self.attachments_remaining = len(all_attachment_ids) - self.attachments_imported
-
-    def _get_attachments(self, res_model: str) -> bool:
+    def _refresh_import_totals(self):
+        """Counts the imported records with a single query. The attachments remaining are the distinct file ids
+        referenced by the notes and emails, semicolon separated as in _get_attachments, that aren't imported yet."""
+        self.flush()
+        self.env.cr.execute("""
+            SELECT (SELECT count(*) FROM durpro_hubspot_import_hubspot_ticket),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_contact),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_company),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_pipeline),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_email),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_note),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_owner),
+                   (SELECT count(*) FROM durpro_hubspot_import_hubspot_attachment),
+                   (SELECT count(*) FROM helpdesk_ticket WHERE hubspot_ticket_id IS NOT NULL),
+                   (SELECT count(*)
+                    FROM (SELECT trim(unnest(string_to_array(hs_attachment_ids, ';'))) AS file_id
+                          FROM durpro_hubspot_import_hubspot_note WHERE hs_attachment_ids IS NOT NULL
+                          UNION
+                          SELECT trim(unnest(string_to_array(hs_attachment_ids, ';')))
+                          FROM durpro_hubspot_import_hubspot_email WHERE hs_attachment_ids IS NOT NULL) f
+                    WHERE f.file_id != '' AND NOT EXISTS (SELECT 1 FROM durpro_hubspot_import_hubspot_attachment a
+                                                          WHERE a.hs_id = f.file_id))""")
+        totals = dict(zip(['tickets_imported', 'contacts_imported', 'companies_imported', 'pipelines_imported',
+                           'emails_imported', 'notes_imported', 'owners_imported', 'attachments_imported',
+                           'tickets_converted', 'attachments_remaining'], self.env.cr.fetchone()))
+        self.write(dict(totals, totals_refreshed_at=fields.Datetime.now()))
+
+    def _get_attachments(self, res_model: str, domain=None, last_id: int = 0) -> Tuple[bool, int]:
         """
         Loads the attachments for all the records of type res_model. Records with existing ir_attachments are
         ignored as this is meant to be run as a one-time import. Records without an associated ticket are also ignored
         for the sake of resource economy.
 
+        Records are walked in id order starting after last_id (keyset pagination), so that a run interrupted for time
+        resumes where it stopped.
+
+        File metadata and contents are downloaded by a bounded pool of threads sharing the HubSpot rate limiter, and
+        streamed to the filestore, while the HubSpotAttachment and ir.attachment records are created on the cron cursor,
+        one batch per page. Files already downloaded, identified by their HubSpot id, are attached again without being
+        downloaded, and identical contents are stored only once (see HubSpotAttachment._store_files). A record's
+        attachments are only written once all of its files are downloaded, so that records cut off by the time limit
+        are picked up again on the next run.
+
         :param res_model: The addressable model name in form module.model_name for which to fetch attachments.
             The model passed is expected to have a field hs_attachment_ids representing the file IDs of the associated
             attachments, semicolon separated.
-        :return: bool. True if import completed, False if interrupted for time.
+        :param domain: Optionally restricts the records of res_model to process.
+        :param last_id: The id of the last record of res_model already processed.
+        :return: Whether the import completed (False if interrupted for time), and the id of the last record
+            processed.
         """
         page_size = 100
-        already_loaded_recs = self.env['ir.attachment'].search([('res_model', '=', res_model)])
-        res_ids = already_loaded_recs.mapped('res_id')
-        domain = [('hs_attachment_ids', '!=', False), ('id', 'not in', res_ids), ('hubspot_tickets', '!=', False)]
-        record_count = self.env[res_model].search_count(domain)
-        call_count = 0
-        start_time = time.time()
-        offset = 0
-        while offset < record_count and self._check_time(20):
-            recs = self.env[res_model].search(domain, offset=offset, limit=page_size)
-            offset += page_size
-            for index, rec in enumerate(recs):
-                if not self._check_time(20):
-                    _logger.info(f"Stopping attachment import for server thread time limit. Processed "
-                                 f"{offset + index} attachments. {record_count - (offset + index)} remaining.")
+        domain = [('hs_attachment_ids', '!=', False), ('hubspot_tickets', '!=', False),
+                  ('mail_message_id', '=', False)] + (domain or [])
+        hs_attachment_model = self.env['durpro_hubspot_import.hubspot_attachment']
+        client = hs_attachment_model._api_client()
+        executor = ThreadPoolExecutor(max_workers=constants.ATTACHMENT_DOWNLOAD_WORKERS)
+        # Downloads are streamed next to the filestore, so that they are moved rather than copied into it
+        download_dir = tempfile.mkdtemp(prefix='hubspot-', dir=self.env['ir.attachment']._filestore())
+        processed = 0
+        completed = False
+        try:
+            while self._check_time(20):
+                recs = self.env[res_model].search(domain + [('id', '>', last_id)], order='id', limit=page_size)
+                if not recs:
+                    completed = True
                     break
-                for file_id in str.split(rec.hs_attachment_ids, ';'):
-                    f = self.env['durpro_hubspot_import.hubspot_attachment'].import_one(file_id)  # one API call
-                    # f is False if the file is not found on HubSpot servers
-                    if not f:
-                        continue
-                    raw = f.get_data()  # one API call
-                    filename = f.name or "" + f.extension or ""
-                    try:
-                        self.env['ir.attachment'].create({
-                            'name': filename,
-                            'raw': raw,
-                            'res_model': res_model,
-                            'res_id': rec.id,
-                        })
-                    except UnidentifiedImageError:
-                        _logger.info(f"Couldn't process attachment # {f.id}: {filename}")
-                        continue
-                    if call_count == 4:
-                        time.sleep(time.time() - start_time)
-                        start_time = time.time()
-                    call_count = (call_count + 1) % 5
-            self.env['ir.attachment'].flush()
-            self.env.cr.commit()
-        completed = offset >= record_count
+                loaded_ids = set(self.env['ir.attachment'].search(
+                    [('res_model', '=', res_model), ('res_id', 'in', recs.ids)]).mapped('res_id'))
+                file_ids = {rec: [i.strip() for i in rec.hs_attachment_ids.split(';') if i.strip()]
+                            for rec in recs if rec.id not in loaded_ids}
+                # Files already in the filestore are attached again rather than downloaded, and files attached to
+                # several records of the page are only downloaded once
+                stored = hs_attachment_model._get_stored_files([i for ids in file_ids.values() for i in ids])
+                fetch_file = metrics.bind(hs_attachment_model.fetch_file)
+                downloads = {file_id: executor.submit(fetch_file, client, file_id, download_dir)
+                             for ids in file_ids.values() for file_id in ids if file_id not in stored}
+                downloaded = {}
+                links = []
+                page_last_id = recs[-1].id
+                for rec, ids in file_ids.items():
+                    if not self._check_time(20):
+                        page_last_id = rec.id - 1
+                        for future in downloads.values():
+                            future.cancel()
+                        break
+                    for file_id in ids:
+                        if file_id in downloads and file_id not in downloaded:
+                            try:
+                                downloaded[file_id] = downloads[file_id].result()
+                            except DailyLimitReached:
+                                raise
+                            except Exception:
+                                _logger.exception(f"Downloading HubSpot file {file_id} failed, skipping it.")
+                                downloaded[file_id] = False
+                        # the download result is False if the file is missing on HubSpot or couldn't be downloaded
+                        if file_id in stored or downloaded[file_id]:
+                            links.append((rec, file_id))
+                    processed += 1
+                stored.update(hs_attachment_model._store_files([d for d in downloaded.values() if d]))
+                # Historical files: images aren't resized on upload, only on the fly by /web/image when displayed
+                self.env['ir.attachment'].with_context(image_no_postprocess=True).create(
+                    [dict(stored[file_id], res_model=res_model, res_id=rec.id) for rec, file_id in links])
+                last_id = page_last_id
+                self.env['ir.attachment'].flush()
+                self.env.cr.commit()
+        finally:
+            # Downloads still running write to download_dir, so they must be over before it's removed
+            executor.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(download_dir, ignore_errors=True)
         if not completed:
-            _logger.info(f"Stopping attachment import for server thread time limit. Processed {offset} attachments. "
-                         f"{record_count - offset} remaining.")
-        return completed
+            _logger.info(f"Stopping attachment import for server thread time limit. Processed {processed} records, "
+                         f"up to {res_model} # {last_id}.")
+        return completed, last_id
 
     @api.depends('ticket_page_size')
-    def create_odoo_tickets(self):
+    def create_odoo_tickets(self, last_id: int = 0) -> Tuple[bool, int]:
         """Converts as many HubSpot Tickets to Odoo tickets as possible in the threading time limit imposed in the
         server config (limit_time_real). Configured page size (see module settings) determines how often we commit to
-        the database. We allow 5 seconds for a final database commit after processing the last batch in the given time
-        limit.
+        the database. Each page is converted at once (see _convert_hubspot_tickets), so we allow 30 seconds for the
+        last page and its commit in the given time limit.
+
+        HubSpot tickets are walked in id order starting after last_id (keyset pagination). Tickets already
+        converted, or without a pipeline and stage mapped to the helpdesk, are filtered out by the search itself.
+
+        :param last_id: The id of the last HubSpot ticket already processed.
+        :return: Whether all the tickets were converted (False if interrupted for time), and the id of the last HubSpot
+            ticket processed.
         """
-        # Handle time limits, turn off notifications
-        already_loaded_ids = self.env['helpdesk.ticket'].search([('hubspot_ticket_id', '!=', False)]).mapped(
-            'hubspot_ticket_id').ids
+        self.ensure_one()
         # temporarily deactivate notifications
         subtype = self.env['mail.message.subtype'].search(
             [('res_model', '=', 'helpdesk.team'), ('relation_field', '=', 'team_id'), ('name', '=', 'Ticket Created')])
@@ -258,81 +242,20 @@ class HubSpotAutoImporter(models.Model):
         stage_template_dict = {s: s.template_id for s in notify_stages}
         notify_stages.write({'template_id': False})
         page_size = int(self.ticket_page_size)
-        domain = [('id', 'not in', already_loaded_ids)]
-        no_tickets = self.env['durpro_hubspot_import.hubspot_ticket'].search_count(domain)
-        offset = 0
-        while offset < no_tickets - 1 and self._check_time(5):
-            # Only work on tickets that have a configured pipeline and stage to which to transfer
-            tickets = self.env['durpro_hubspot_import.hubspot_ticket'].search(domain,
-                                                                              offset=offset, limit=page_size).filtered(
-                lambda
-                    r: r.pipeline and r.pipeline.helpdesk_team_id and r.pipeline_stage and r.pipeline_stage.helpdesk_stage)
-            offset += page_size
-            for index, ticket in enumerate(tickets):
-                if not self._check_time(5):
-                    _logger.info(f"Stopping Odoo Ticket Creation for server thread time limit. Processed "
-                                 f"{offset + index} tickets. {no_tickets - (offset + index)} remain to be processed.")
-                    break
-                # Create a ticket in the right pipeline
-                hs_time = ticket.hs_time_to_time(ticket.createdate) if ticket.createdate else False
-                create_date = time.strftime('%Y-%m-%d %H:%M:%S', hs_time) if hs_time else False
-                hd_ticket = self.env['helpdesk.ticket'].create({
-                    'name': ticket.subject or ticket.content or "No Subject",
-                    'description': plaintext2html(ticket.content),
-                    'create_date': create_date,
-                    'team_id': ticket.pipeline.helpdesk_team_id.id,
-                    'stage_id': ticket.pipeline_stage.helpdesk_stage.id,
-                    'user_id': ticket.user_id.id if ticket.user_id else False,
-                    'partner_id': ticket.associated_contacts[
-                        0].odoo_contact.id if ticket.associated_contacts else False,
-                    'hubspot_ticket_id': ticket.id,
-                })
-
-                # Add the notes and emails to the chatter with their attachments
-                for note in ticket.associated_notes:
-                    # Start by creating the attachments, then we'll link them up appropriately later
-                    # We let ir.attachment guess the mimetype since HubSpot's file type field is non-MIME
-                    attachments = self.env['ir.attachment'].search(
-                        [('res_model', '=', 'durpro_hubspot_import.hubspot_note'),
-                         ('res_id', 'in', [n.id for n in ticket.associated_notes])])
-                    hs_time = note.hs_time_to_time(note.hs_created_date) if note.hs_created_date else False
-                    create_date = time.strftime('%Y-%m-%d %H:%M:%S', hs_time) if hs_time else False
-                    message = hd_ticket.sudo().message_post(body=note.hs_note_body,
-                                                            message_type='comment',
-                                                            author_id=note.author.id if note.author else False,
-                                                            attachment_ids=attachments.ids,
-                                                            date=create_date, )
-                    attachments.write({
-                        'res_model': message._name,
-                        'res_id': message.id,
-                        'create_date': create_date})
-
-                for email in ticket.associated_emails:
-                    attachments = self.env['ir.attachment'].search(
-                        [('res_model', '=', 'durpro_hubspot_import.hubspot_email'),
-                         ('res_id', 'in', [e.id for e in ticket.associated_emails])])
-                    hs_time = email.hs_time_to_time(email.hs_createdate) if email.hs_createdate else False
-                    create_date = time.strftime('%Y-%m-%d %H:%M:%S', hs_time) if hs_time else False
-                    body = email.hs_email_html or plaintext2html(email.hs_email_text) or plaintext2html("")
-                    tree = etree.fromstring(body, parser=etree.HTMLParser())
-                    if tree is None:
-                        body = plaintext2html(email.hs_email_text) or plaintext2html("")
-                        tree = etree.fromstring(body, parser=etree.HTMLParser())
-                        if tree is None:
-                            body = ""
-                    message = hd_ticket.sudo().message_post(subject=email.hs_email_subject or "",
-                                                            body=body,
-                                                            message_type='email',
-                                                            author_id=email.author.id if email.author else False,
-                                                            email_from=email.hs_email_from_email if not email.author else False,
-                                                            partner_ids=email.recipients.ids,
-                                                            attachment_ids=attachments.ids,
-                                                            date=create_date,
-                                                            )
-                    attachments.write({
-                        'res_model': message._name,
-                        'res_id': message.id,
-                        'create_date': create_date})
+        # Only work on tickets that have a configured pipeline and stage to which to transfer
+        domain = [('helpdesk_ticket_ids', '=', False), ('pipeline.helpdesk_team_id', '!=', False),
+                  ('pipeline_stage.helpdesk_stage', '!=', False)]
+        processed = 0
+        completed = False
+        while self._check_time(30):
+            tickets = self.env['durpro_hubspot_import.hubspot_ticket'].search(
+                domain + [('id', '>', last_id)], order='id', limit=page_size)
+            if not tickets:
+                completed = True
+                break
+            self._convert_hubspot_tickets(tickets)
+            processed += len(tickets)
+            last_id = tickets[-1].id
             self.env['ir.attachment'].flush()
             self.env['mail.message'].flush()
             self.env.cr.commit()
@@ -342,8 +265,199 @@ class HubSpotAutoImporter(models.Model):
         for s in notify_stages:
             s.write({'template_id': stage_template_dict[s].id})
         self.env.cr.commit()
-        if offset < no_tickets:
-            _logger.info(f"Stopping Odoo Ticket Creation for server thread time limit. Processed at least"
-                         f"{offset} tickets. {no_tickets - offset} remain to be processed.")
+        if not completed:
+            _logger.info(f"Stopping Odoo Ticket Creation for server thread time limit. Processed {processed} tickets, "
+                         f"up to HubSpot ticket # {last_id}.")
+        return completed, last_id
+
+    @api.model
+    def _convert_hubspot_tickets(self, tickets):
+        """
+        Converts a page of HubSpot tickets to helpdesk tickets, created in a single batch without the mail thread
+        tracking and subscriptions, then posts their notes and emails with _post_messages.
+
+        :return: The created helpdesk tickets, in the order of tickets.
+        """
+        vals_list = []
+        for ticket in tickets:
+            vals_list.append(dict(
+                ticket._get_helpdesk_ticket_vals(),
+                description=plaintext2html(ticket.content),
+                create_date=ticket.createdate,
+                partner_id=ticket.associated_contacts[0].odoo_contact.id if ticket.associated_contacts else False,
+                hubspot_ticket_id=ticket.id,
+            ))
+        hd_tickets = self.env['helpdesk.ticket'].with_context(**NO_MAIL_CONTEXT).create(vals_list)
+        metrics.add('objects', len(hd_tickets))
+        posts = []
+        for ticket, hd_ticket in zip(tickets, hd_tickets):
+            posts.extend((hd_ticket, note) for note in ticket.associated_notes)
+            posts.extend((hd_ticket, email) for email in ticket.associated_emails)
+        self._post_messages(posts)
+        return hd_tickets
+
+    def _sync_associations(self) -> bool:
+        """Re-reads the associations of the tickets, notes and emails flagged by the incremental sync. As the
+        associations are replaced rather than added to, we simply start over when interrupted for time.
+
+        :return: bool. True if completed, False if interrupted for time.
+        """
+        pending = [('sync_pending', '=', True)]
+        ticket_model = self.env['durpro_hubspot_import.hubspot_ticket']
+        passes = [
+            (ticket_model, 'ticket', 'contact', 'associated_contacts'),
+            (ticket_model, 'ticket', 'company', 'associated_companies'),
+            (ticket_model, 'ticket', 'email', 'associated_emails'),
+            (ticket_model, 'ticket', 'note', 'associated_notes'),
+            (self.env['durpro_hubspot_import.hubspot_note'], 'note', 'ticket', 'hubspot_tickets'),
+            (self.env['durpro_hubspot_import.hubspot_email'], 'email', 'ticket', 'hubspot_tickets'),
+        ]
+        for model, from_suffix, to_suffix, association_field in passes:
+            if not self._check_time(10):
+                return False
+            if model.import_associations(from_suffix, to_suffix, association_field, domain=pending):
+                return False
+        return True
+
+    def _sync_helpdesk_tickets(self) -> bool:
+        """
+        Carries the changes flagged by the incremental sync over to the helpdesk tickets converted from HubSpot
+        tickets: updates the tickets themselves, updates the chatter messages of the changed notes and emails, and posts
+        the new notes and emails. The sync_pending flags are cleared as the records are processed. HubSpot tickets that
+        were never converted are left to create_odoo_tickets.
+
+        :return: bool. True if completed, False if interrupted for time.
+        """
+        page_size = 100
+        pending = [('sync_pending', '=', True)]
+        helpdesk_tickets = self.env['helpdesk.ticket'].with_context(tracking_disable=True, mail_notrack=True)
+        while self._check_time(10):
+            tickets = self.env['durpro_hubspot_import.hubspot_ticket'].search(pending, limit=page_size)
+            if not tickets:
+                break
+            for hd_ticket in helpdesk_tickets.search([('hubspot_ticket_id', 'in', tickets.ids)]):
+                ticket = hd_ticket.hubspot_ticket_id
+                vals = ticket._get_helpdesk_ticket_vals()
+                if not ticket.pipeline.helpdesk_team_id or not ticket.pipeline_stage.helpdesk_stage:
+                    # Moved to a pipeline or stage that isn't mapped to the helpdesk, keep the current team and stage
+                    del vals['team_id'], vals['stage_id']
+                hd_ticket.write(vals)
+            tickets.write({'sync_pending': False})
+            self.env.cr.commit()
+        for res_model in ('durpro_hubspot_import.hubspot_note', 'durpro_hubspot_import.hubspot_email'):
+            while self._check_time(10):
+                records = self.env[res_model].search(pending, limit=page_size)
+                if not records:
+                    break
+                is_note = res_model == 'durpro_hubspot_import.hubspot_note'
+                if not is_note:
+                    records._prepare_message_bodies()
+                posts = []
+                bodies = []
+                for rec in records:
+                    if rec.mail_message_id:
+                        if is_note:
+                            rec.mail_message_id.write({'body': rec.hs_note_body})
+                        else:
+                            rec.mail_message_id.write({'subject': rec.hs_email_subject or ""})
+                            bodies.append((rec.mail_message_id, rec.message_body))
+                        continue
+                    posts.extend((hd_ticket, rec) for hd_ticket in
+                                 helpdesk_tickets.search([('hubspot_ticket_id', 'in', rec.hubspot_tickets.ids)]))
+                self._write_message_bodies(bodies)
+                self._post_messages(posts)
+                records.write({'sync_pending': False})
+                self.env['ir.attachment'].flush()
+                self.env['mail.message'].flush()
+                self.env.cr.commit()
+        if not self._check_time(10):
             return False
+        for res_model in ('durpro_hubspot_import.hubspot_contact', 'durpro_hubspot_import.hubspot_company'):
+            self.env[res_model].search(pending).write({'sync_pending': False})
         return True
+
+    @api.model
+    def _post_messages(self, posts):
+        """
+        Posts HubSpot notes and emails to the chatter of helpdesk tickets, with their attachments. The messages are
+        created directly in a single batch rather than through message_post, so that no notification is computed or
+        sent for these historical messages, and the attachments of all the records are fetched in one query. The email
+        bodies are sanitized beforehand for the whole batch (see HubSpotEmail._prepare_message_bodies).
+
+        A record posted to several tickets gets its attachments on the first message only, since they are moved to it.
+
+        :param posts: (helpdesk ticket, HubSpot note or email) tuples.
+        :return: The created messages, in the order of posts.
+        """
+        if not posts:
+            return self.env['mail.message']
+        res_ids = {}
+        for hd_ticket, rec in posts:
+            res_ids.setdefault(rec._name, set()).add(rec.id)
+        self.env['durpro_hubspot_import.hubspot_email'].browse(
+            res_ids.get('durpro_hubspot_import.hubspot_email', ()))._prepare_message_bodies()
+        # We let ir.attachment guess the mimetype since HubSpot's file type field is non-MIME
+        attachment_ids = {}
+        for res_model, ids in res_ids.items():
+            for attachment in self.env['ir.attachment'].search_read(
+                    [('res_model', '=', res_model), ('res_id', 'in', list(ids))], ['res_id']):
+                attachment_ids.setdefault((res_model, attachment['res_id']), []).append(attachment['id'])
+        note_subtype_id = self.env['ir.model.data']._xmlid_to_res_id('mail.mt_note')
+        message_vals = []
+        for hd_ticket, rec in posts:
+            is_note = rec._name == 'durpro_hubspot_import.hubspot_note'
+            hs_created = rec.hs_created_date if is_note else rec.hs_createdate
+            vals = {
+                'model': hd_ticket._name,
+                'res_id': hd_ticket.id,
+                'record_name': hd_ticket.display_name,
+                'message_type': 'comment' if is_note else 'email',
+                'subtype_id': note_subtype_id,
+                'author_id': rec.author.id,
+                'email_from': rec.author.email_formatted if rec.author else False,
+                'attachment_ids': [fields.Command.set(attachment_ids.pop((rec._name, rec.id), []))],
+            }
+            if hs_created:
+                vals['date'] = hs_created
+            if is_note:
+                vals['body'] = rec.hs_note_body
+            else:
+                vals.update({
+                    'email_from': vals['email_from'] or rec.hs_email_from_email,
+                    'subject': rec.hs_email_subject or "",
+                    'partner_ids': [fields.Command.set(rec.recipients.ids)],
+                })
+            message_vals.append(vals)
+        messages = self.env['mail.message'].sudo().create(message_vals)
+        moved = [(attachment_id, message.id, message.date)
+                 for message in messages for attachment_id in message.attachment_ids.ids]
+        if moved:
+            self.env['ir.attachment'].flush(['res_model', 'res_id', 'create_date'])
+            self.env.cr.execute(f"""UPDATE ir_attachment a
+                                    SET res_model = 'mail.message', res_id = m.message_id, create_date = m.date
+                                    FROM (VALUES {", ".join(["(%s, %s, %s)"] * len(moved))})
+                                        AS m(attachment_id, message_id, date)
+                                    WHERE a.id = m.attachment_id""", [value for row in moved for value in row])
+            self.env['ir.attachment'].invalidate_cache(['res_model', 'res_id', 'create_date'])
+        self._write_message_bodies([(message, rec.message_body) for (hd_ticket, rec), message in zip(posts, messages)
+                                    if rec._name == 'durpro_hubspot_import.hubspot_email'])
+        for (hd_ticket, rec), message in zip(posts, messages):
+            rec.mail_message_id = message
+        return messages
+
+    @api.model
+    def _write_message_bodies(self, bodies):
+        """
+        Writes already sanitized bodies to chatter messages in a single query, bypassing the sanitization of
+        mail.message.
+
+        :param bodies: (message, sanitized body) tuples.
+        """
+        if not bodies:
+            return
+        self.env['mail.message'].flush(['body'])
+        self.env.cr.execute(f"""UPDATE mail_message m SET body = b.body
+                                FROM (VALUES {", ".join(["(%s, %s)"] * len(bodies))}) AS b(message_id, body)
+                                WHERE m.id = b.message_id""", [value for message, body in bodies
+                                                                 for value in (message.id, body or "")])
+        self.env['mail.message'].invalidate_cache(['body'], [message.id for message, body in bodies])
@@ -9,22 +9,25 @@ class HubSpotCompany(models.Model):
     hubspot_model_name = "companies"
     hubspot_id_field = "hs_object_id"
 
-    hs_object_id = fields.Char(string="HS Object ID - Unique ID for this object", compute="_extract_hs_fields",
-                               store=True)
-    sdi_client = fields.Char(string="SDI Client (Yes/No)", compute="_extract_hs_fields", store=True)
-    total_revenue = fields.Char(string="Total revenue.", compute="_extract_hs_fields", store=True)
-    name = fields.Char(string="HS Company Name", compute="_extract_hs_fields", store=True)
-    phone = fields.Char(string="HS Phone", compute="_extract_hs_fields", store=True)
-    address = fields.Char(string="HS Address", compute="_extract_hs_fields", store=True)
-    address2 = fields.Char(string="HS Address 2nd line", compute="_extract_hs_fields", store=True)
-    city = fields.Char(string="HS City", compute="_extract_hs_fields", store=True)
-    state = fields.Char(string="HS State or Province", compute="_extract_hs_fields", store=True)
-    zip = fields.Char(string="HS Zip/Postal Code", compute="_extract_hs_fields", store=True)
-    country = fields.Char(string="HS Country", compute="_extract_hs_fields", store=True)
-    website = fields.Char(string="HS Website", compute="_extract_hs_fields", store=True)
-    domain = fields.Char(string="HS Domain", compute="_extract_hs_fields", store=True)
-    industry = fields.Char(string="HS Industry", compute="_extract_hs_fields", store=True)
-    description = fields.Char(string="HS Description", compute="_extract_hs_fields", store=True)
+    _sql_constraints = [
+        ('hs_object_id_unique', 'unique(hs_object_id)', 'A HubSpot company can only be imported once.'),
+    ]
+
+    hs_object_id = fields.Char(string="HS Object ID - Unique ID for this object", readonly=True)
+    sdi_client = fields.Char(string="SDI Client (Yes/No)", readonly=True)
+    total_revenue = fields.Char(string="Total revenue.", readonly=True)
+    name = fields.Char(string="HS Company Name", readonly=True)
+    phone = fields.Char(string="HS Phone", readonly=True)
+    address = fields.Char(string="HS Address", readonly=True)
+    address2 = fields.Char(string="HS Address 2nd line", readonly=True)
+    city = fields.Char(string="HS City", readonly=True)
+    state = fields.Char(string="HS State or Province", readonly=True)
+    zip = fields.Char(string="HS Zip/Postal Code", readonly=True)
+    country = fields.Char(string="HS Country", readonly=True)
+    website = fields.Char(string="HS Website", readonly=True)
+    domain = fields.Char(string="HS Domain", readonly=True)
+    industry = fields.Char(string="HS Industry", readonly=True)
+    description = fields.Char(string="HS Description", readonly=True)
 
     odoo_partner = fields.Many2one("res.partner", string="Matching Odoo Partner (company)",
                                    compute='_match_company', store=True)
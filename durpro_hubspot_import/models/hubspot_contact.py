@@ -9,23 +9,28 @@ class HubSpotContact(models.Model):
     hubspot_model_name = "contacts"
     hubspot_id_field = "hs_object_id"
 
-    hs_object_id = fields.Char(string="HS Object ID", compute="_extract_hs_fields", store=True)
-    hs_additional_emails = fields.Char(string="HS Additional Emails", compute="_extract_hs_fields", store=True)
-    hs_calculated_phone_number = fields.Char(string="HS Phone Number", compute="_extract_hs_fields", store=True)
-    hs_calculated_mobile_number = fields.Char(string="HS Mobile Number", compute="_extract_hs_fields", store=True)
-    hs_email_domain = fields.Char(string="HS Email Domain", compute="_extract_hs_fields", store=True)
-    firstname = fields.Char(string="HS First Name", compute="_extract_hs_fields", store=True)
-    lastname = fields.Char(string="HS Last Name", compute="_extract_hs_fields", store=True)
-    email = fields.Char(string="HS Email", compute="_extract_hs_fields", store=True)
-    mobilephone = fields.Char(string="HS Mobile Phone", compute="_extract_hs_fields", store=True)
-    phone = fields.Char(string="HS Phone", compute="_extract_hs_fields", store=True)
-    address = fields.Char(string="HS Address", compute="_extract_hs_fields", store=True)
-    city = fields.Char(string="HS City", compute="_extract_hs_fields", store=True)
-    state = fields.Char(string="HS State", compute="_extract_hs_fields", store=True)
-    zip = fields.Char(string="HS Zip", compute="_extract_hs_fields", store=True)
-    country = fields.Char(string="HS Country", compute="_extract_hs_fields", store=True)
-    hs_language = fields.Char(string="HS Language", compute="_extract_hs_fields", store=True)
-    company = fields.Char(string="HS Company", compute="_extract_hs_fields", store=True)
+    _sql_constraints = [
+        ('hs_object_id_unique', 'unique(hs_object_id)', 'A HubSpot contact can only be imported once.'),
+    ]
+    hubspot_lastmodified_property = "lastmodifieddate"
+
+    hs_object_id = fields.Char(string="HS Object ID", readonly=True)
+    hs_additional_emails = fields.Char(string="HS Additional Emails", readonly=True)
+    hs_calculated_phone_number = fields.Char(string="HS Phone Number", readonly=True)
+    hs_calculated_mobile_number = fields.Char(string="HS Mobile Number", readonly=True)
+    hs_email_domain = fields.Char(string="HS Email Domain", readonly=True)
+    firstname = fields.Char(string="HS First Name", readonly=True)
+    lastname = fields.Char(string="HS Last Name", readonly=True)
+    email = fields.Char(string="HS Email", readonly=True)
+    mobilephone = fields.Char(string="HS Mobile Phone", readonly=True)
+    phone = fields.Char(string="HS Phone", readonly=True)
+    address = fields.Char(string="HS Address", readonly=True)
+    city = fields.Char(string="HS City", readonly=True)
+    state = fields.Char(string="HS State", readonly=True)
+    zip = fields.Char(string="HS Zip", readonly=True)
+    country = fields.Char(string="HS Country", readonly=True)
+    hs_language = fields.Char(string="HS Language", readonly=True)
+    company = fields.Char(string="HS Company", readonly=True)
 
     odoo_contact = fields.Many2one('res.partner', string='Matching Odoo Contact', compute='_match_contact', store=True)
 
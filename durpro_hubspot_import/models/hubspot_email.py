@@ -1,4 +1,6 @@
 from odoo import models, fields, api, _
+from odoo.tools import email_normalize, email_split
+from .. import sanitize_pool
 
 
 class HubSpotEmail(models.Model):
@@ -8,22 +10,28 @@ class HubSpotEmail(models.Model):
 
     hubspot_model_name = "emails"
     hubspot_id_field = "hs_id"
+    # The bodies are only kept in their fields, not duplicated in the JSON contents
+    hubspot_stripped_properties = ('hs_email_html', 'hs_email_text')
+    hubspot_local_fields = ('message_body',)
 
-    hs_id = fields.Char(string="Email ID", compute="_extract_hs_fields", store=True)
-    hs_unique_id = fields.Char(string="HS Unique ID", compute="_extract_hs_fields", store=True)
-    hs_email_message_id = fields.Char(string="HS Email Message ID", compute="_extract_hs_fields", store=True)
-    hs_createdate = fields.Char(string="HS Create Date", compute="_extract_hs_fields", store=True)
-    hs_email_from_email = fields.Char(string="HS Email From", compute="_extract_hs_fields", store=True)
-    hs_email_cc_email = fields.Char(string="HS Email CC", compute="_extract_hs_fields", store=True)
-    hs_email_direction = fields.Char(string="HS Email Direction", compute="_extract_hs_fields",
-                                     store=True)
-    hs_email_html = fields.Char(string="HS Email Html", compute="_extract_hs_fields", store=True)
-    hs_email_subject = fields.Char(string="HS Email Subject", compute="_extract_hs_fields", store=True)
-    hs_email_text = fields.Char(string="HS Email Text", compute="_extract_hs_fields", store=True)
+    _sql_constraints = [
+        ('hs_id_unique', 'unique(hs_id)', 'A HubSpot email can only be imported once.'),
+    ]
+
+    hs_id = fields.Char(string="Email ID", readonly=True)
+    hs_unique_id = fields.Char(string="HS Unique ID", readonly=True)
+    hs_email_message_id = fields.Char(string="HS Email Message ID", readonly=True)
+    hs_createdate = fields.Datetime(string="HS Create Date", readonly=True, index=True)
+    hs_email_from_email = fields.Char(string="HS Email From", readonly=True)
+    hs_email_cc_email = fields.Char(string="HS Email CC", readonly=True)
+    hs_email_direction = fields.Char(string="HS Email Direction", readonly=True)
+    hs_email_html = fields.Char(string="HS Email Html", readonly=True)
+    hs_email_subject = fields.Char(string="HS Email Subject", readonly=True)
+    hs_email_text = fields.Char(string="HS Email Text", readonly=True)
     # attachment ids are semicolon separated
-    hs_attachment_ids = fields.Char(string="HS Email Attachments", compute="_extract_hs_fields", store=True)
-    hs_email_to_email = fields.Char(string="HS Email To Email", compute="_extract_hs_fields", store=True)
-    hubspot_owner_id = fields.Char(string="HS Owner ID", compute="_extract_hs_fields", store=True)
+    hs_attachment_ids = fields.Char(string="HS Email Attachments", readonly=True)
+    hs_email_to_email = fields.Char(string="HS Email To Email", readonly=True)
+    hubspot_owner_id = fields.Char(string="HS Owner ID", readonly=True)
 
     owner = fields.Many2one("durpro_hubspot_import.hubspot_owner", string="HubSpot Owner", compute="_compute_owner",
                             store=True)
@@ -32,42 +40,86 @@ class HubSpotEmail(models.Model):
 
     hubspot_tickets = fields.Many2many("durpro_hubspot_import.hubspot_ticket", "durpro_hubspot_import_ticket_email_rel",
                                        "hs_object_id", "hs_ticket_id", string="Associated Tickets")
+    message_body = fields.Html(string="Sanitized Body", sanitize=False, readonly=True,
+                               help="The body the email is posted with, sanitized ahead of the ticket conversion.")
+    mail_message_id = fields.Many2one("mail.message", string="Posted Message", readonly=True,
+                                      help="The chatter message this email was posted as on its helpdesk ticket.")
 
     @api.depends('hubspot_owner_id')
     def _compute_owner(self):
+        owners = self.env['durpro_hubspot_import.hubspot_owner'].search(
+            [('hs_id', 'in', list(set(self.mapped('hubspot_owner_id'))))])
+        owners_dict = {o.hs_id: o for o in owners}
         for rec in self:
-            if not rec.hubspot_owner_id:
-                continue
-            rec.owner = self.env['durpro_hubspot_import.hubspot_owner'].search([('hs_id', '=', rec.hubspot_owner_id)])
+            rec.owner = owners_dict.get(rec.hubspot_owner_id, False)
 
     @api.depends("hs_email_from_email", "hs_email_cc_email", "hs_email_to_email")
     def _compute_sender_recipients(self):
+        # Addresses are semicolon separated. They are normalized (lowercased) once and all resolved with one search.
+        senders = {}
+        recipients = {}
+        for rec in self:
+            senders[rec] = self._normalize_addresses(rec.hs_email_from_email)[:1]
+            recipients[rec] = self._normalize_addresses(rec.hs_email_to_email) + \
+                self._normalize_addresses(rec.hs_email_cc_email)
+        emails = set()
+        for addresses in list(senders.values()) + list(recipients.values()):
+            emails.update(addresses)
+        partners_dict = {}
+        if emails:
+            for partner in self.env['res.partner'].search([('email_normalized', 'in', list(emails))], order='id'):
+                partners_dict.setdefault(partner.email_normalized, partner)
+        partners = self.env['res.partner']
         for rec in self:
-            recipients = []
-            if rec.hs_email_to_email:
-                recipients.append(str.split(rec.hs_email_to_email, ";"))
-            if rec.hs_email_cc_email:
-                recipients.append(str.split(rec.hs_email_cc_email, ";"))
-            partners = self.env['res.partner'].search([('email', 'in', recipients)])
-            authors = self.env['res.partner'].search([('email', '=like', rec.hs_email_from_email)])
-            rec.author = authors[0] if authors else False
-            if partners:
-                rec.write({'recipients': fields.Command.set([p.id for p in partners])})
-            else:
-                rec.recipients = False
+            rec.author = partners_dict[senders[rec][0]] if senders[rec] and senders[rec][0] in partners_dict else False
+            rec.recipients = partners.union(*[partners_dict[e] for e in recipients[rec] if e in partners_dict])
 
     @api.model
-    def _extract_hs_fields(self):
+    def _normalize_addresses(self, addresses: str) -> list:
+        """The normalized email addresses of a semicolon separated list of HubSpot addresses."""
+        if not addresses:
+            return []
+        normalized = [email_normalize(address) for address in email_split(addresses.replace(";", ","))]
+        return [address for address in normalized if address]
+
+    @api.model
+    def _hs_property_sql(self, fname: str) -> str:
         """
         Overload to wrap HTML snippets with html and body tags where necessary. HubSpot is inconsistent in its HTML
         contents for emails.
-        :return: None
         """
-        super()._extract_hs_fields()
-        for rec in self:
-            if rec.hs_email_html and "<html>" not in rec.hs_email_html:
-                if "<body>" not in rec.hs_email_html:
-                    rec.hs_email_html = "<body>" + rec.hs_email_html + "</body>"
-                rec.hs_email_html = "<html>" + rec.hs_email_html + "</html>"
+        value = super()._hs_property_sql(fname)
+        if fname != 'hs_email_html':
+            return value
+        return f"""CASE WHEN COALESCE({value}, '') = '' OR strpos({value}, '<html>') > 0 THEN {value}
+                        WHEN strpos({value}, '<body>') > 0 THEN '<html>' || {value} || '</html>'
+                        ELSE '<html><body>' || {value} || '</body></html>' END"""
 
+    def _extract_hs_fields(self):
+        """Overload to drop the sanitized message bodies, which are prepared again from the extracted properties."""
+        super()._extract_hs_fields()
+        self.message_body = False
 
+    def _prepare_message_bodies(self):
+        """
+        Sanitizes the message bodies of these emails that don't have one yet, the way the body of mail.message would,
+        and stores them in message_body. The bodies are parsed and sanitized in parallel by a pool of processes (see
+        sanitize_pool.py), and can then be written to the messages as they are (see
+        HubSpotAutoImporter._write_message_bodies).
+        """
+        emails = self.filtered(lambda e: not e.message_body)
+        if not emails:
+            return
+        field = self.env['mail.message']._fields['body']
+        options = {
+            'sanitize_tags': field.sanitize_tags,
+            'sanitize_attributes': field.sanitize_attributes,
+            'sanitize_style': field.sanitize_style,
+            'sanitize_form': field.sanitize_form,
+            'strip_style': field.strip_style,
+            'strip_classes': field.strip_classes,
+        }
+        bodies = sanitize_pool.sanitize_email_bodies(emails.mapped('hs_email_html'), emails.mapped('hs_email_text'),
+                                                     options)
+        for email, body in zip(emails, bodies):
+            email.message_body = body
@@ -0,0 +1,284 @@
+from odoo import models, fields, api, _
+from odoo.tools import config, mute_logger
+from .. import constants
+from .. import metrics
+from ..rate_limiter import DailyLimitReached
+from datetime import timedelta
+from psycopg2.extensions import TransactionRollbackError
+import logging
+import traceback
+
+_logger = logging.getLogger(__name__)
+
+JOB_PHASES = [
+    ('pipelines', 'Pipelines'),
+    ('owners', 'Owners'),
+    ('tickets', 'Tickets'),
+    ('contacts', 'Contacts'),
+    ('companies', 'Companies'),
+    ('notes', 'Notes'),
+    ('emails', 'Emails'),
+    ('associate_contacts', 'Contact Associations'),
+    ('associate_companies', 'Company Associations'),
+    ('associate_emails', 'Email Associations'),
+    ('associate_notes', 'Note Associations'),
+    ('note_attachments', 'Note Attachments'),
+    ('email_attachments', 'Email Attachments'),
+    ('create_tickets', 'Create Tickets'),
+    ('sync_tickets', 'Sync Changed Tickets'),
+    ('sync_contacts', 'Sync Changed Contacts'),
+    ('sync_companies', 'Sync Changed Companies'),
+    ('sync_notes', 'Sync Changed Notes'),
+    ('sync_emails', 'Sync Changed Emails'),
+    ('sync_associations', 'Sync Associations'),
+    ('sync_note_attachments', 'Sync Note Attachments'),
+    ('sync_email_attachments', 'Sync Email Attachments'),
+    ('sync_helpdesk', 'Sync Helpdesk Tickets'),
+    ('sync_create_tickets', 'Create New Tickets'),
+]
+
+# Phases of the initial import, with the phases that must be complete before they can start
+IMPORT_PHASES = {
+    'pipelines': [],
+    'owners': [],
+    # Tickets, notes and emails are linked to their pipeline and owner as they are created
+    'tickets': ['pipelines', 'owners'],
+    'contacts': [],
+    'companies': [],
+    'notes': ['owners'],
+    'emails': ['owners'],
+    'associate_contacts': ['tickets', 'contacts'],
+    'associate_companies': ['tickets', 'companies'],
+    'associate_emails': ['tickets', 'emails'],
+    'associate_notes': ['tickets', 'notes'],
+    'note_attachments': ['associate_notes'],
+    # Notes and emails share files, whose attachments concurrent upserts would fail to serialize
+    'email_attachments': ['associate_emails', 'note_attachments'],
+    'create_tickets': ['associate_contacts', 'associate_companies', 'note_attachments', 'email_attachments'],
+}
+
+# Phases of an incremental sync cycle, started once the initial import and the previous cycle are complete
+SYNC_PHASES = {
+    'sync_tickets': [],
+    'sync_contacts': [],
+    'sync_companies': [],
+    'sync_notes': [],
+    'sync_emails': [],
+    'sync_associations': ['sync_tickets', 'sync_contacts', 'sync_companies', 'sync_notes', 'sync_emails'],
+    'sync_note_attachments': ['sync_associations'],
+    'sync_email_attachments': ['sync_associations', 'sync_note_attachments'],
+    'sync_helpdesk': ['sync_note_attachments', 'sync_email_attachments'],
+    'sync_create_tickets': ['sync_helpdesk'],
+}
+
+PHASE_DEPENDENCIES = dict(IMPORT_PHASES, **SYNC_PHASES)
+
+# Object phases: model suffix, and the phase of the other kind (import or sync) sharing the watermark
+OBJECT_PHASES = {
+    'tickets': ('ticket', 'sync_tickets'),
+    'contacts': ('contact', 'sync_contacts'),
+    'companies': ('company', 'sync_companies'),
+    'notes': ('note', 'sync_notes'),
+    'emails': ('email', 'sync_emails'),
+}
+SYNC_OBJECT_PHASES = {sync_phase: (suffix, phase) for phase, (suffix, sync_phase) in OBJECT_PHASES.items()}
+
+ASSOCIATION_PHASES = {
+    'associate_contacts': 'import_associated_contacts',
+    'associate_companies': 'import_associated_companies',
+    'associate_emails': 'import_associated_emails',
+    'associate_notes': 'import_associated_notes',
+}
+
+ATTACHMENT_PHASES = {
+    'note_attachments': ('durpro_hubspot_import.hubspot_note', False),
+    'email_attachments': ('durpro_hubspot_import.hubspot_email', False),
+    'sync_note_attachments': ('durpro_hubspot_import.hubspot_note', True),
+    'sync_email_attachments': ('durpro_hubspot_import.hubspot_email', True),
+}
+
+
+class HubSpotImportJob(models.Model):
+    """One chunk of work of an import phase, run by the import scheduled actions (see HubSpotAutoImporter.run_next).
+
+    Each job runs its phase from its cursor for as long as the time limit allows, commits as it goes, and, if the phase
+    isn't complete, enqueues a job for the next chunk with the cursor reached. Every chunk is idempotent (objects are
+    upserted, associations replaced and records walked by id), so a job that fails or whose worker is killed is simply
+    run again, up to HS_JOB_MAX_ATTEMPTS times.
+
+    Several workers run jobs at once: a job is ready when no job of the phases it depends on is left unfinished, and
+    workers claim ready jobs with SELECT ... FOR UPDATE SKIP LOCKED, so that independent phases run in parallel."""
+
+    _name = "durpro_hubspot_import.import_job"
+    _description = "HubSpot Import Job"
+    _order = "id desc"
+
+    phase = fields.Selection(JOB_PHASES, string="Phase", required=True, readonly=True)
+    state = fields.Selection(string="State", required=True, default='pending', index=True, readonly=True, selection=[
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ])
+    cursor = fields.Char(string="Cursor", readonly=True,
+                         help="Where the chunk starts: the HubSpot after token or the id of the last record processed.")
+    watermark = fields.Datetime(string="Synced Until", readonly=True,
+                                help="Objects modified in HubSpot from this date on are fetched by the next sync.")
+    attempts = fields.Integer(string="Attempts", readonly=True)
+    claimed_at = fields.Datetime(string="Claimed At", readonly=True)
+    error = fields.Text(string="Last Error", readonly=True)
+
+    @api.model
+    def _enqueue(self):
+        """Enqueues the jobs of the initial import on the first run, then a new incremental sync cycle whenever the
+        previous jobs are all done and incremental sync is enabled."""
+        # Only one worker enqueues at a time
+        self.env.cr.execute("SELECT pg_try_advisory_xact_lock(%s)", (constants.HS_JOB_ENQUEUE_LOCK,))
+        if not self.env.cr.fetchone()[0]:
+            return
+        self._cleanup()
+        if not self.search_count([]):
+            self.create([{'phase': phase} for phase in IMPORT_PHASES])
+        elif not self.search_count([('state', '!=', 'done')]) \
+                and self.env['ir.config_parameter'].sudo().get_param(constants.HS_INCREMENTAL_SYNC_PARAM):
+            self.create([{'phase': phase} for phase in SYNC_PHASES])
+        self.env.cr.commit()
+
+    @api.model
+    def _cleanup(self):
+        """Deletes the old done jobs, keeping the last one of each phase, which holds its sync watermark, and the old
+        job metrics."""
+        self.flush()
+        retention_date = fields.Datetime.now() - timedelta(days=constants.HS_JOB_RETENTION_DAYS)
+        self.env['durpro_hubspot_import.import_metric'].search([('started_at', '<', retention_date)]).unlink()
+        self.env.cr.execute("""DELETE FROM durpro_hubspot_import_import_job j
+                               WHERE j.state = 'done' AND j.create_date < %s
+                               AND EXISTS (SELECT 1 FROM durpro_hubspot_import_import_job k
+                                           WHERE k.phase = j.phase AND k.state = 'done' AND k.id > j.id)""",
+                            (retention_date,))
+        self.invalidate_cache()
+
+    @api.model
+    def _claim(self):
+        """Claims a job ready to run, if any, and marks it as running.
+
+        Jobs left running for longer than the time limit belong to a worker that was killed, and are claimed again."""
+        self.flush()
+        self.env.cr.execute("SELECT DISTINCT phase FROM durpro_hubspot_import_import_job WHERE state != 'done'")
+        unfinished = {row[0] for row in self.env.cr.fetchall()}
+        ready = [phase for phase in unfinished if not unfinished.intersection(PHASE_DEPENDENCIES[phase])]
+        if not ready:
+            return self.browse()
+        self.env.cr.execute("""SELECT id FROM durpro_hubspot_import_import_job
+                               WHERE phase IN %s AND (state = 'pending' OR (state = 'running' AND claimed_at < %s))
+                               ORDER BY id
+                               LIMIT 1
+                               FOR UPDATE SKIP LOCKED""", (tuple(ready), fields.Datetime.now() - self._time_limit()))
+        row = self.env.cr.fetchone()
+        if not row:
+            return self.browse()
+        job = self.browse(row[0])
+        job.write({'state': 'running', 'claimed_at': fields.Datetime.now(), 'attempts': job.attempts + 1})
+        self.env.cr.commit()
+        return job
+
+    @api.model
+    def _time_limit(self) -> timedelta:
+        time_limit = config['limit_time_real']
+        if time_limit == 0:  # Odoo.sh sets a fake 0 sec time limit, but cuts us off at 900s
+            time_limit = 900
+        return timedelta(seconds=time_limit)
+
+    def _run(self):
+        """Runs this job's chunk, then marks it as done and enqueues the next chunk if the phase isn't complete. On
+        failure the changes not yet committed are rolled back and the job is retried later."""
+        self.ensure_one()
+        _logger.info(f"Running HubSpot import job {self.id}: {self.phase} from {self.cursor or 'start'}.")
+        # The metrics stop being collected when the block exits, before they are recorded on every path
+        try:
+            with metrics.collect() as job_metrics:
+                completed, cursor, watermark = self._run_chunk()
+        except DailyLimitReached:
+            self.env.cr.rollback()
+            self.env.clear()
+            self.write({'state': 'pending', 'attempts': self.attempts - 1})
+            self.env['durpro_hubspot_import.import_metric']._record(self, job_metrics, 'failed')
+            self.env.cr.commit()
+            raise
+        except Exception:
+            self.env.cr.rollback()
+            self.env.clear()
+            _logger.exception(f"HubSpot import job {self.id} ({self.phase}) failed.")
+            self.write({
+                'state': 'failed' if self.attempts >= constants.HS_JOB_MAX_ATTEMPTS else 'pending',
+                'error': traceback.format_exc(),
+            })
+            self.env['durpro_hubspot_import.import_metric']._record(self, job_metrics, 'failed')
+            self.env.cr.commit()
+            return
+        if not completed:
+            self.create({'phase': self.phase, 'cursor': cursor, 'watermark': watermark})
+        self.write({'state': 'done', 'watermark': watermark, 'error': False})
+        self.env['durpro_hubspot_import.import_metric']._record(
+            self, job_metrics, 'completed' if completed else 'interrupted')
+        self.env.cr.commit()
+        if completed:
+            self._refresh_import_totals()
+
+    @api.model
+    def _refresh_import_totals(self):
+        """Refreshes the import totals of the controller in a transaction of its own, once a phase is completed and
+        committed. Workers completing phases at the same time all write the controller, so all but one of them may fail
+        to serialize: their refresh is simply skipped, the totals being refreshed again by the next phase completed."""
+        try:
+            with mute_logger('odoo.sql_db'):
+                self.env['durpro_hubspot_import.auto_importer'].search([('active', 'in', (True, False))],
+                                                                       limit=1)._refresh_import_totals()
+                self.env.cr.commit()
+        except TransactionRollbackError:
+            self.env.cr.rollback()
+            self.env.clear()
+            _logger.info("The HubSpot import totals are being refreshed by another worker, skipping.")
+
+    def _run_chunk(self):
+        """Runs this job's phase from its cursor until it completes or the time limit is near.
+
+        :return: Whether the phase completed, the cursor to resume from and the sync watermark reached, if any.
+        """
+        controller = self.env['durpro_hubspot_import.auto_importer'].search([('active', 'in', (True, False))], limit=1)
+        phase = self.phase
+        if phase in ('pipelines', 'owners'):
+            self.env[f'durpro_hubspot_import.hubspot_{phase[:-1]}'].import_all()
+            return True, False, False
+        if phase in OBJECT_PHASES:
+            # Objects changed in HubSpot during the initial import are caught by the first sync
+            watermark = self.watermark or fields.Datetime.now()
+            after = self.env[f'durpro_hubspot_import.hubspot_{OBJECT_PHASES[phase][0]}'].import_all(self.cursor or None)
+            return not after, after, watermark
+        if phase in SYNC_OBJECT_PHASES:
+            suffix, import_phase = SYNC_OBJECT_PHASES[phase]
+            since = self.watermark or self.search([('phase', 'in', (phase, import_phase)), ('state', '=', 'done'),
+                                                   ('watermark', '!=', False)], limit=1).watermark
+            watermark, completed = self.env[f'durpro_hubspot_import.hubspot_{suffix}'].import_changed(since or None)
+            return completed, False, watermark
+        if phase in ASSOCIATION_PHASES:
+            last_id = getattr(self.env['durpro_hubspot_import.hubspot_ticket'], ASSOCIATION_PHASES[phase])(
+                int(self.cursor or 0))
+            return not last_id, str(last_id), False
+        if phase in ATTACHMENT_PHASES:
+            res_model, pending_only = ATTACHMENT_PHASES[phase]
+            completed, last_id = controller._get_attachments(
+                res_model, [('sync_pending', '=', True)] if pending_only else None, int(self.cursor or 0))
+            return completed, str(last_id), False
+        if phase in ('create_tickets', 'sync_create_tickets'):
+            completed, last_id = controller.create_odoo_tickets(int(self.cursor or 0))
+            return completed, str(last_id), False
+        if phase == 'sync_associations':
+            return controller._sync_associations(), False, False
+        if phase == 'sync_helpdesk':
+            return controller._sync_helpdesk_tickets(), False, False
+        raise ValueError(f"Unknown HubSpot import phase {phase}")
+
+    def action_retry(self):
+        """Puts failed jobs back in the queue."""
+        self.filtered(lambda j: j.state == 'failed').write({'state': 'pending', 'attempts': 0})
@@ -0,0 +1,59 @@
+from odoo import models, fields, api
+from .hubspot_import_job import JOB_PHASES
+from datetime import datetime
+
+
+class HubSpotImportMetric(models.Model):
+    """Where the time of each import job run goes: objects processed, HubSpot API calls and throttling, database time
+    and downloads, as collected by metrics.collect() around the job's chunk."""
+
+    _name = "durpro_hubspot_import.import_metric"
+    _description = "HubSpot Import Job Metrics"
+    _order = "id desc"
+
+    controller_id = fields.Many2one("durpro_hubspot_import.auto_importer", string="Import Controller",
+                                    ondelete="cascade", index=True)
+    job_id = fields.Many2one("durpro_hubspot_import.import_job", string="Job", ondelete="set null")
+    phase = fields.Selection(JOB_PHASES, string="Phase", readonly=True)
+    outcome = fields.Selection(string="Outcome", readonly=True, selection=[
+        ('completed', 'Phase Completed'),
+        ('interrupted', 'Interrupted for Time'),
+        ('failed', 'Failed'),
+    ])
+    started_at = fields.Datetime(string="Started At", readonly=True)
+    duration = fields.Float(string="Duration (s)", readonly=True)
+    objects = fields.Integer(string="Objects", readonly=True,
+                             help="HubSpot objects and files stored, tickets whose associations were read, or helpdesk "
+                                  "tickets created, depending on the phase.")
+    objects_per_second = fields.Float(string="Objects/s", compute="_compute_objects_per_second", store=True)
+    api_calls = fields.Integer(string="API Calls", readonly=True)
+    api_retries = fields.Integer(string="API Retries", readonly=True, help="Calls retried after a 429 response.")
+    throttled_seconds = fields.Float(string="Throttled (s)", readonly=True,
+                                     help="Time spent waiting for the rate limiter, summed over the download threads.")
+    db_queries = fields.Integer(string="DB Queries", readonly=True)
+    db_seconds = fields.Float(string="DB Time (s)", readonly=True)
+    megabytes_downloaded = fields.Float(string="Downloaded (MB)", readonly=True)
+
+    @api.depends('objects', 'duration')
+    def _compute_objects_per_second(self):
+        for rec in self:
+            rec.objects_per_second = rec.objects / rec.duration if rec.duration else 0.0
+
+    @api.model
+    def _record(self, job, job_metrics, outcome: str):
+        """Records the metrics collected while running a job, once they are stopped."""
+        controller = self.env['durpro_hubspot_import.auto_importer'].search([('active', 'in', (True, False))],
+                                                                            limit=1)
+        counters = dict(job_metrics.counters)
+        counters['megabytes_downloaded'] = counters.pop('bytes_downloaded') / 1e6
+        return self.create(dict(
+            counters,
+            controller_id=controller.id,
+            job_id=job.id,
+            phase=job.phase,
+            outcome=outcome,
+            started_at=datetime.utcfromtimestamp(job_metrics.started),
+            duration=job_metrics.duration,
+            db_queries=job_metrics.db_queries,
+            db_seconds=job_metrics.db_seconds,
+        ))
@@ -1,10 +1,15 @@
 from odoo import models, fields, api, _
 from .. import constants
-import json
+from .. import metrics
+from ..client_pool import get_client
+from ..json_field import Jsonb
+from ..rate_limiter import hubspot_search_rate_limiter
+from datetime import datetime, timedelta, timezone
 from hubspot import HubSpot
 from hubspot.crm.associations.models.batch_input_public_object_id import BatchInputPublicObjectId
+from hubspot.crm.objects.models.public_object_search_request import PublicObjectSearchRequest
 import time
-from typing import Union
+from typing import Tuple, Union
 import threading
 import time
 from odoo.tools import config
@@ -20,39 +25,96 @@ class HubSpotModel(models.AbstractModel):
       1. The hubspot_model_name (string) that matches the endpoint URL for the API.
       2. The exact field names from hubspot as model fields (If an object returns the property "id",
          name the field "hs_id" to have it extracted into the appropriate model field).
-      3. The member hubspot_id_field (str) that gives the name of the hubspot unique identifier field for the model."""
+      3. The member hubspot_id_field (str) that gives the name of the hubspot unique identifier field for the model,
+         with a unique constraint on it (see _upsert).
+
+    Subclasses may override hubspot_lastmodified_property, the property used to search for the objects modified since
+    the last incremental sync, hubspot_stripped_properties, the properties only kept in their field and removed
+    from the stored JSON contents once extracted (e.g. large bodies), and hubspot_local_fields, the fields set by the
+    import itself rather than extracted from the HubSpot properties."""
 
     _name = "durpro_hubspot_import.hubspot_model"
     _description = 'Abstract model common to (almost) all Hubspot Import models'
 
-    contents = fields.Char(string="JSON Contents")
+    hubspot_lastmodified_property = "hs_lastmodifieddate"
+    hubspot_stripped_properties = ()
+    hubspot_local_fields = ()
+
+    contents = Jsonb(string="JSON Contents")
+    sync_pending = fields.Boolean(string="Pending Sync", index=True, readonly=True,
+                                  help="Changed in HubSpot since the last incremental sync.")
 
     def _api_client(self) -> HubSpot:
-        return HubSpot(access_token=self.env['ir.config_parameter'].sudo().get_param(constants.APPKEY_PARAM))
+        """Returns the HubSpot client cached for this worker process (see client_pool.py). Its API calls reuse a
+        keep-alive connection pool and all go through the shared rate limiter, so callers don't need to throttle
+        themselves."""
+        params = self.env['ir.config_parameter'].sudo()
+        return get_client(params.get_param(constants.APPKEY_PARAM), params.get_param(constants.HS_API_HOST_PARAM))
 
-    @api.depends('contents')
     def _extract_hs_fields(self):
-        fields = self.get_hs_properties_list()
-        for rec in self:
-            hs_model = json.loads(rec.contents)
-            if 'properties' in hs_model:
-                properties = hs_model['properties']
-            else:
-                properties = hs_model
-            to_write = {}
-            for field in fields:
-                if field == 'contents':
-                    continue
-                to_read = 'id' if field == 'hs_id' else field
-                if to_read in properties:
-                    to_write[field] = properties[to_read]
-                if to_read in hs_model:
-                    to_write[field] = hs_model[to_read]
-            rec.write(to_write)
+        """(Re)extracts the stored HubSpot properties of these records from their JSON contents, in a single UPDATE
+        statement, then strips hubspot_stripped_properties from the contents."""
+        if not self:
+            return
+        fnames = [f for f in self._get_hs_property_fields() if f != self.hubspot_id_field]
+        assignments = [f'"{fname}" = {self._hs_property_sql(fname)}' for fname in fnames]
+        if self.hubspot_stripped_properties:
+            assignments.append("contents = contents" + "".join(
+                f" #- '{{properties,{prop}}}'" for prop in self.hubspot_stripped_properties))
+        self.flush(fnames + ['contents'], self)
+        self.env.cr.execute(f'UPDATE "{self._table}" SET {", ".join(assignments)} WHERE id IN %s', [tuple(self.ids)])
+        self.invalidate_cache(fnames + ['contents'], self.ids)
+        self.modified(fnames)
+
+    @api.model
+    def _hs_property_sql(self, fname: str) -> str:
+        """
+        The SQL expression reading the value of a HubSpot property field from the contents column. The object's
+        top level keys take precedence over its properties. The property "id" goes to the field hs_id.
+
+        Datetime fields are parsed from HubSpot's ISO 8601 timestamps (e.g. 2023-05-01T12:34:56.789Z) to naive UTC
+        by Postgres, for the whole batch at once. Values that aren't timestamps are stored as NULL.
+        """
+        key = 'id' if fname == 'hs_id' else fname
+        value = f"COALESCE(contents->>'{key}', contents->'properties'->>'{key}')"
+        if self._fields[fname].type == 'datetime':
+            value = f"""CASE WHEN {value} ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}}[T ]\\d{{2}}:\\d{{2}}'
+                             THEN ({value})::timestamptz AT TIME ZONE 'UTC' END"""
+        else:
+            value = f"{value}::{self._fields[fname].column_type[1]}"
+        if fname in self.hubspot_stripped_properties:
+            # Stripped from the contents after a first extraction, so keep the current value if not found
+            value = f'COALESCE({value}, "{fname}")'
+        return value
+
+    @api.model
+    def _store_hs_objects(self, hs_objects, update: bool = False, vals=None):
+        """
+        Stores HubSpot objects as the JSON contents of records of this model (see _upsert), then extracts their
+        properties in SQL.
+
+        :param hs_objects: The HubSpot objects as dicts, as returned by the SDK objects' to_dict().
+        :param update: Whether to update the records already imported rather than skipping them.
+        :param vals: Additional values to set on every record.
+        :return: The inserted (and updated) records.
+        """
+        records = self._upsert([dict(vals or {}, **{self.hubspot_id_field: str(o['id']), 'contents': o})
+                                for o in hs_objects], update=update)
+        records._extract_hs_fields()
+        return records
+
+    @api.model
+    def _get_hs_property_fields(self):
+        """The plain (non-computed, non-relational) fields holding HubSpot properties."""
+        return [name for name, field in self._fields.items()
+                if name not in constants.BASE_FIELDS and name not in ('contents', 'sync_pending')
+                and name not in self.hubspot_local_fields and field.store
+                and not field.compute
+                and not field.relational]
 
     @api.model
     def get_hs_properties_list(self):
-        return list(set(list(self.fields_get())) - constants.BASE_FIELDS)
+        return self._get_hs_property_fields()
 
     @api.model
     def _check_time(self, delay: int) -> bool:
@@ -76,74 +138,202 @@ class HubSpotModel(models.AbstractModel):
         """
         properties = self.get_hs_properties_list()
         PAGE_MAX_SIZE = 100
-        call_count = 0
-        start_time = time.time()
         while True and self._check_time(10):
             page = self._api_client().crm.objects.basic_api.get_page(self.hubspot_model_name, after=after,
                                                                      limit=PAGE_MAX_SIZE, properties=properties)
-            objects_fetched = page.results
-            already_loaded = self.env[self._name].search(
-                [(self.hubspot_id_field, 'in', [o.id for o in objects_fetched])]).mapped(self.hubspot_id_field)
-            for obj in objects_fetched:
-                if obj.id in already_loaded:
-                    continue
-                object_as_dict = obj.to_dict()
-                contents = json.dumps(object_as_dict, default=str)
-                self.env[self._name].create({'contents': contents})
+            # Objects already imported are skipped by the upsert
+            self._store_hs_objects([obj.to_dict() for obj in page.results])
             self.env[self._name].flush()
             self.env.cr.commit()
             if page.paging is None:
                 return None
             after = page.paging.next.after
-            if call_count == 9:
-                time.sleep(time.time() - start_time)
-                start_time = time.time()
-            call_count = (call_count + 1) % 10
         return after
 
     @api.model
-    def import_associations(self, model_from_suffix, model_to_suffix, association_field, start: int = 0) -> int:
-        rs_from_count = self.env[f'durpro_hubspot_import.hubspot_{model_from_suffix}'].search_count([])
-        i = start
-        start_time = time.time()
-        while i < rs_from_count - 1 and self._check_time(10):
-            associations = {}
-            rs_from = self.env[f'durpro_hubspot_import.hubspot_{model_from_suffix}'].search([], offset=i, limit=100)
-            rs_from_dict = {getattr(r, rs_from.hubspot_id_field): r for r in rs_from}
-            i += 100
-            if i % 1000 == 0:
-                time.sleep(time.time() - start_time)
-                start_time = time.time()
-            ids = BatchInputPublicObjectId(inputs=[{'id': getattr(r, r.hubspot_id_field)} for r in rs_from])
-            rs_to = self.env[f'durpro_hubspot_import.hubspot_{model_to_suffix}']
-            recs = self._api_client().crm.associations.batch_api.read(self.hubspot_model_name, rs_to.hubspot_model_name,
-                                                                      batch_input_public_object_id=ids).results
-            for rec in recs:
-                rec = rec.to_dict()
-                from_rec = rs_from_dict[rec['_from']['id']]
-                rs_to = self.env[f'durpro_hubspot_import.hubspot_{model_to_suffix}'].search(
-                    [(rs_to.hubspot_id_field, 'in', [r['id'] for r in rec['to']])])
-                if not from_rec or not rs_to:
-                    continue
-                associations.setdefault(from_rec, []).extend([r for r in rs_to])
-            for from_rec, to_recs in associations.items():
-                from_rec.write({association_field: [(6, 0, [r.id for r in to_recs])]})
+    def import_changed(self, since: datetime = None) -> Tuple[datetime, bool]:
+        """
+        Incremental counterpart of import_all. Uses the CRM search API to fetch the objects modified in HubSpot since
+        the given watermark, creates the new ones and updates the ones already imported. All of them are flagged with
+        sync_pending so that the changes can be carried over to their associations and helpdesk tickets. We commit
+        after every page.
+
+        :param since: The watermark, as a naive UTC datetime. Objects modified at or after it are fetched. Everything
+            is fetched if not set.
+        :return: The new watermark (the last modification date fetched), and whether all the changed objects were
+            fetched (False if interrupted for time).
+        """
+        properties = self.get_hs_properties_list() + [self.hubspot_lastmodified_property]
+        watermark = since
+        search_from = since
+        after = None
+        PAGE_MAX_SIZE = 100
+        while self._check_time(10):
+            filters = []
+            if watermark:
+                filters.append({
+                    'propertyName': self.hubspot_lastmodified_property,
+                    'operator': 'GTE',
+                    'value': str(int(watermark.replace(tzinfo=timezone.utc).timestamp() * 1000)),
+                })
+            request = PublicObjectSearchRequest(
+                filter_groups=[{'filters': filters}] if filters else [],
+                sorts=[{'propertyName': self.hubspot_lastmodified_property, 'direction': 'ASCENDING'}],
+                properties=properties, limit=PAGE_MAX_SIZE, after=after)
+            page = hubspot_search_rate_limiter.call(self._api_client().crm.objects.search_api.do_search,
+                                                    self.hubspot_model_name, public_object_search_request=request)
+            self._upsert_hs_objects(page.results)
+            modified = [self._hs_timestamp_to_datetime(o.properties.get(self.hubspot_lastmodified_property))
+                        for o in page.results]
+            modified = [m for m in modified if m]
+            if modified:
+                watermark = max([watermark, *modified]) if watermark else max(modified)
             self.env.cr.commit()
-        return i if i < rs_from_count - 1 else 0
+            if page.paging is None:
+                return watermark, True
+            after = int(page.paging.next.after)
+            if after + PAGE_MAX_SIZE > constants.HS_SEARCH_MAX_RESULTS:
+                # The search API won't page past its result cap, so start a new search from the watermark instead.
+                if watermark == search_from:
+                    # A whole result cap was modified in the same millisecond, so a new search from it would return
+                    # the same results again. Skip past it rather than search it forever.
+                    _logger.warning(f"More than {constants.HS_SEARCH_MAX_RESULTS} {self.hubspot_model_name} were "
+                                    f"modified at {watermark}, some of them may not be imported.")
+                    watermark += timedelta(milliseconds=1)
+                search_from = watermark
+                after = None
+        return watermark, False
 
     @api.model
-    def hs_time_to_time(self, hs_timestamp: str) -> Union[time.struct_time, bool]:
+    def _upsert_hs_objects(self, objects):
+        """Creates the records for the given HubSpot SDK objects, or updates the ones already imported, and flags them
+        all as pending sync.
+
+        :return: The created and updated records.
+        """
+        records = self._store_hs_objects([obj.to_dict() for obj in objects], update=True, vals={'sync_pending': True})
+        self.env[self._name].flush()
+        return records
+
+    @api.model
+    def _upsert(self, vals_list, update: bool = False):
+        """
+        Inserts the records for vals_list with a single INSERT ... ON CONFLICT on the HubSpot id field, so that
+        duplicate detection is left to its unique index. Records already imported are skipped, or updated if update
+        is set. The stored fields depending on the inserted values are then recomputed as they would be by create().
+
+        :param vals_list: Values of stored, non-relational fields only, each including the HubSpot id field. When
+            several values share a HubSpot id, the last one wins.
+        :param update: Whether to update the records already imported rather than skipping them.
+        :return: The inserted (and updated) records.
         """
-        Converts a HubSpot formatted timestamp to a usable format for Odoo fields.
+        vals_by_hs_id = {vals[self.hubspot_id_field]: vals for vals in vals_list if vals.get(self.hubspot_id_field)}
+        if not vals_by_hs_id:
+            return self.browse()
+        self.flush()
+        fnames = sorted({fname for vals in vals_by_hs_id.values() for fname in vals})
+        empty = self.browse()
+        columns = fnames + ['create_uid', 'write_uid', 'create_date', 'write_date']
+        row = "(%s)" % ", ".join(["%s"] * (len(fnames) + 2) + ["(now() at time zone 'UTC')"] * 2)
+        params = []
+        for vals in vals_by_hs_id.values():
+            params.extend(self._fields[fname].convert_to_column(vals.get(fname), empty) for fname in fnames)
+            params.extend([self.env.uid, self.env.uid])
+        if update:
+            conflict = "DO UPDATE SET " + ", ".join(
+                f'"{column}" = EXCLUDED."{column}"' for column in columns if column not in ('create_uid', 'create_date'))
+        else:
+            conflict = "DO NOTHING"
+        self.env.cr.execute(f"""INSERT INTO "{self._table}" ({", ".join(f'"{c}"' for c in columns)})
+                                VALUES {", ".join([row] * len(vals_by_hs_id))}
+                                ON CONFLICT ("{self.hubspot_id_field}") {conflict}
+                                RETURNING id, xmax = 0""", params)
+        rows = self.env.cr.fetchall()
+        records = self.browse([r[0] for r in rows])
+        metrics.add('objects', len(vals_by_hs_id))
+        if update:
+            records.invalidate_cache(fnames)
+        records.modified(fnames)
+        # Like create(), compute all the stored computed fields of the inserted records
+        inserted = self.browse([r[0] for r in rows if r[1]])
+        for field in self._fields.values():
+            if field.store and field.compute:
+                self.env.add_to_compute(field, inserted)
+        return records
 
-        :param hs_timestamp: HubSpot timestamp string
+    @api.model
+    def import_associations(self, model_from_suffix, model_to_suffix, association_field, last_id: int = 0,
+                            domain=None) -> int:
+        """
+        Reads the associations between the records of two HubSpot models and stores them in association_field. The
+        records of the from model are walked in id order, in batches of the size allowed by the associations API,
+        starting after last_id (keyset pagination), so that resuming after a timeout is exact and every batch costs
+        the same. For each batch, the target HubSpot ids are resolved with a single query and the relation table is
+        filled with a single insert.
 
-        :return: A python struct_time representation of the HubSpot timestamp
+        :param last_id: The id of the last record of the from model already processed.
+        :param domain: Restricts the records of the from model to process (all by default).
+        :return: The id of the last record processed if interrupted for time, otherwise 0.
         """
+        domain = domain or []
+        model_from = self.env[f'durpro_hubspot_import.hubspot_{model_from_suffix}']
+        model_to = self.env[f'durpro_hubspot_import.hubspot_{model_to_suffix}']
+        while True:
+            rs_from = model_from.search(domain + [('id', '>', last_id)], order='id',
+                                        limit=constants.HS_ASSOCIATION_BATCH_SIZE)
+            if not rs_from:
+                return 0
+            last_id = rs_from[-1].id
+            metrics.add('objects', len(rs_from))
+            from_ids = {getattr(r, r.hubspot_id_field): r.id for r in rs_from}
+            ids = BatchInputPublicObjectId(inputs=[{'id': hs_id} for hs_id in from_ids])
+            results = [r.to_dict() for r in self._api_client().crm.associations.batch_api.read(
+                self.hubspot_model_name, model_to.hubspot_model_name, batch_input_public_object_id=ids).results]
+            to_hs_ids = list({to['id'] for r in results for to in r['to']})
+            to_ids = {r[model_to.hubspot_id_field]: r['id'] for r in model_to.search_read(
+                [(model_to.hubspot_id_field, 'in', to_hs_ids)], [model_to.hubspot_id_field])}
+            pairs = set()
+            for r in results:
+                from_id = from_ids.get(r['_from']['id'])
+                if from_id:
+                    pairs.update((from_id, to_ids[to['id']]) for to in r['to'] if to['id'] in to_ids)
+            model_from._set_associations(association_field, rs_from.ids, pairs)
+            self.env.cr.commit()
+            if not self._check_time(10):
+                return last_id
+
+    @api.model
+    def _set_associations(self, association_field: str, record_ids, pairs):
+        """
+        Replaces the content of a Many2many field for the given records, directly in the relation table.
+
+        :param association_field: The name of a Many2many field of this model.
+        :param record_ids: The ids of the records whose associations were read. Those not appearing in pairs have no
+            associations left, and are cleared.
+        :param pairs: (record id, associated record id) tuples.
+        """
+        if not record_ids:
+            return
+        field = self._fields[association_field]
+        from_ids = sorted(set(record_ids))
+        self.flush([association_field])
+        self.env.cr.execute(f"DELETE FROM {field.relation} WHERE {field.column1} IN %s", (tuple(from_ids),))
+        if pairs:
+            self.env.cr.execute(f"INSERT INTO {field.relation} ({field.column1}, {field.column2}) "
+                                f"VALUES {', '.join(['(%s, %s)'] * len(pairs))} ON CONFLICT DO NOTHING",
+                                [value for pair in pairs for value in pair])
+        records = self.browse(from_ids)
+        records.modified([association_field])
+        # The inverse Many2many of the comodel is cached too
+        self.invalidate_cache()
+
+    @api.model
+    def _hs_timestamp_to_datetime(self, hs_timestamp: str) -> Union[datetime, bool]:
+        """Converts a HubSpot ISO 8601 timestamp (e.g. 2023-05-01T12:34:56.789Z) to a naive UTC datetime."""
+        if not hs_timestamp:
+            return False
         try:
-            return time.strptime(hs_timestamp, "%Y-%m-%dT%H:%M:%S[.%f]Z")
+            return datetime.fromisoformat(hs_timestamp.replace('Z', '+00:00')).astimezone(timezone.utc).replace(
+                tzinfo=None)
         except ValueError:
-            try:
-                return time.strptime(hs_timestamp, "%Y-%m-%dT%H:%M:%SZ")
-            except ValueError:
-                return False
+            return False
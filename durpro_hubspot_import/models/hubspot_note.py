@@ -9,19 +9,25 @@ class HubSpotNote(models.Model):
     hubspot_model_name = "notes"
     hubspot_id_field = "hs_object_id"
 
-    hs_object_id = fields.Char("HS Object ID", compute="_extract_hs_fields", store=True)
-    hs_created_by = fields.Char("HS Created By", compute="_extract_hs_fields", store=True)
-    hs_created_date = fields.Char("HS Created Date", compute="_extract_hs_fields", store=True)
-    hs_note_body = fields.Char("HS Note Body", compute="_extract_hs_fields", store=True)
-    hubspot_owner_id = fields.Char("HS Owner ID", compute="_extract_hs_fields", store=True)
+    _sql_constraints = [
+        ('hs_object_id_unique', 'unique(hs_object_id)', 'A HubSpot note can only be imported once.'),
+    ]
 
-    hs_attachment_ids = fields.Char("HS Attachment IDs", compute="_extract_hs_fields", store=True)
+    hs_object_id = fields.Char("HS Object ID", readonly=True)
+    hs_created_by = fields.Char("HS Created By", readonly=True)
+    hs_created_date = fields.Datetime("HS Created Date", readonly=True, index=True)
+    hs_note_body = fields.Char("HS Note Body", readonly=True)
+    hubspot_owner_id = fields.Char("HS Owner ID", readonly=True)
+
+    hs_attachment_ids = fields.Char("HS Attachment IDs", readonly=True)
 
     owner = fields.Many2one("durpro_hubspot_import.hubspot_owner", string="HubSpot Owner", compute="_compute_owner",
                             store=True)
     author = fields.Many2one("res.partner", string="Note Author", compute="_compute_author")
     hubspot_tickets = fields.Many2many("durpro_hubspot_import.hubspot_ticket", "durpro_hubspot_import_ticket_note_rel",
                                        "hs_object_id", "hs_ticket_id", string="Associated Tickets")
+    mail_message_id = fields.Many2one("mail.message", string="Posted Message", readonly=True,
+                                      help="The chatter message this note was posted as on its helpdesk ticket.")
 
     @api.depends("hs_created_by")
     def _compute_author(self):
@@ -35,7 +41,8 @@ class HubSpotNote(models.Model):
 
     @api.depends('hubspot_owner_id')
     def _compute_owner(self):
+        owners = self.env['durpro_hubspot_import.hubspot_owner'].search(
+            [('hs_id', 'in', list(set(self.mapped('hubspot_owner_id'))))])
+        owners_dict = {o.hs_id: o for o in owners}
         for rec in self:
-            if not rec.hubspot_owner_id:
-                continue
-            rec.owner = self.env['durpro_hubspot_import.hubspot_owner'].search([('hs_id', '=', rec.hubspot_owner_id)])
+            rec.owner = owners_dict.get(rec.hubspot_owner_id, False)
@@ -1,4 +1,5 @@
 from odoo import fields, models, api
+from odoo.osv import expression
 
 
 class ModelName(models.Model):
@@ -10,6 +11,10 @@ class ModelName(models.Model):
     hubspot_model_name = 'owners'
     hubspot_id_field = "hs_id"
 
+    _sql_constraints = [
+        ('hs_id_unique', 'unique(hs_id)', 'A HubSpot owner can only be imported once.'),
+    ]
+
     hs_id = fields.Char("HS ID")
     user_id = fields.Char("HS User ID")
     email = fields.Char("HS Email")
@@ -22,21 +27,19 @@ class ModelName(models.Model):
     def import_all(self):
         recs = self._api_client().crm.owners.get_all()
         properties = self.get_hs_properties_list()
-        properties.remove('contents')
-        properties.remove('odoo_user')
-        already_imported = self.env['durpro_hubspot_import.hubspot_owner'].search([]).mapped('hs_id')
-        for rec in recs:
-            if rec.id in already_imported:
-                continue
-            self.env[self._name].create(
-                {field: getattr(rec, field.replace('hs_id', 'id')) for field in properties})
+        # Owners already imported are skipped by the upsert
+        self._upsert([{field: getattr(rec, field.replace('hs_id', 'id')) for field in properties} for rec in recs])
 
     def _extract_hs_fields(self):
         pass
 
     @api.depends("email")
     def _compute_odoo_user(self):
+        emails = {e.lower() for e in self.mapped('email') if e}
+        users = self.env['res.users'].search(expression.OR([[('email', '=ilike', e)] for e in emails])) \
+            if emails else self.env['res.users']
+        users_dict = {}
+        for user in users:
+            users_dict.setdefault(user.email.lower(), user)
         for rec in self:
-            if not rec.email:
-                continue
-            rec.odoo_user = self.env['res.users'].search([('email', '=ilike', rec.email)])
+            rec.odoo_user = users_dict.get(rec.email.lower(), False) if rec.email else False
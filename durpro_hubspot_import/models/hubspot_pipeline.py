@@ -6,6 +6,12 @@ class HubSpotPipeline(models.Model):
     _inherit = "durpro_hubspot_import.hubspot_model"
     _description = 'Carries information imported from Hubspot Pipelines'
 
+    hubspot_id_field = "hs_pipeline_id"
+
+    _sql_constraints = [
+        ('hs_pipeline_id_unique', 'unique(hs_pipeline_id)', 'A HubSpot pipeline can only be imported once.'),
+    ]
+
     label = fields.Char(string="Label", )
     display_order = fields.Integer(string="Display Order", )
     hs_archived = fields.Boolean(string="HS archived", )
@@ -24,32 +30,38 @@ class HubSpotPipeline(models.Model):
 
         Results structure at https://developers.hubspot.com/docs/api/crm/pipelines under "Retrieve all pipelines"
         """
-        objects_fetched = self._api_client().crm.pipelines.pipelines_api.get_all(object_type="tickets").results
-        already_loaded = self.env[self._name].search([]).mapped('hs_pipeline_id')
+        objects_fetched = [o.to_dict() for o in
+                           self._api_client().crm.pipelines.pipelines_api.get_all(object_type="tickets").results]
+        # Pipelines already imported are skipped by the upsert, but their stages are kept up to date, so that stages
+        # added in HubSpot since are imported too
+        self._upsert([{
+            'label': obj['label'],
+            'display_order': obj['display_order'],
+            'hs_archived': obj['archived'],
+            'hs_pipeline_id': obj['id'],
+        } for obj in objects_fetched])
+        pipelines = self.search([('hs_pipeline_id', 'in', [obj['id'] for obj in objects_fetched])])
+        pipeline_ids = {p.hs_pipeline_id: p.id for p in pipelines}
+        stage_model = self.env['durpro_hubspot_import.hubspot_pipeline_stage']
+        existing = {(stage.hs_pipeline_id.id, stage.hs_stage_id): stage
+                    for stage in stage_model.search([('hs_pipeline_id', 'in', pipelines.ids)])}
+        to_create = []
         for obj in objects_fetched:
-            if obj.id in already_loaded:
-                continue
-            obj = obj.to_dict()
-            pipeline_vars = {
-                'label': obj['label'],
-                'display_order': obj['display_order'],
-                'hs_archived': obj['archived'],
-                'hs_pipeline_id': obj['id'],
-            }
-            pipeline = self.env[self._name].create(pipeline_vars)
-            if 'stages' in obj:
-                stages = []
-                for stage in obj['stages']:
-                    stages.append({
-                        'label': stage['label'],
-                        'hs_stage_id': stage['id'],
-                        'hs_pipeline_id': pipeline.id,
-                        'display_order': stage['display_order'],
-                        'hs_archived': stage['archived'],
-                        'ticket_state': stage['metadata']['ticketState'],
-                    })
-                recs = self.env['durpro_hubspot_import.hubspot_pipeline_stage'].create(stages)
-                pipeline.stages = recs
+            for stage in obj.get('stages') or []:
+                vals = {
+                    'label': stage['label'],
+                    'hs_stage_id': stage['id'],
+                    'hs_pipeline_id': pipeline_ids[obj['id']],
+                    'display_order': stage['display_order'],
+                    'hs_archived': stage['archived'],
+                    'ticket_state': stage['metadata']['ticketState'],
+                }
+                record = existing.get((vals['hs_pipeline_id'], vals['hs_stage_id']))
+                if record:
+                    record.write(vals)
+                else:
+                    to_create.append(vals)
+        stage_model.create(to_create)
 
     def _extract_hs_fields(self):
         """ In this case we do it directly in import_all due to the different structure"""
@@ -66,6 +78,11 @@ class HubSpotPipelineStage(models.Model):
     _name = "durpro_hubspot_import.hubspot_pipeline_stage"
     _description = 'Carries information imported from Hubspot Pipeline Stages'
 
+    _sql_constraints = [
+        ('hs_stage_id_unique', 'unique(hs_stage_id, hs_pipeline_id)',
+         'A HubSpot pipeline stage can only be imported once.'),
+    ]
+
     label = fields.Char("HS Stage Label", )
     hs_stage_id = fields.Char("HS Stage ID", )
     hs_pipeline_id = fields.Many2one("durpro_hubspot_import.hubspot_pipeline", string="Hubspot Pipeline", )
@@ -1,7 +1,10 @@
 from odoo import models, fields, api, _
+import logging
 import time
 from hubspot.crm.associations.models.batch_input_public_object_id import BatchInputPublicObjectId
 
+_logger = logging.getLogger(__name__)
+
 
 class HubSpotTicket(models.Model):
     _name = "durpro_hubspot_import.hubspot_ticket"
@@ -11,27 +14,31 @@ class HubSpotTicket(models.Model):
     hubspot_model_name = "tickets"
     hubspot_id_field = "hs_ticket_id"
 
+    _sql_constraints = [
+        ('hs_ticket_id_unique', 'unique(hs_ticket_id)', 'A HubSpot ticket can only be imported once.'),
+    ]
+
     # Basic fields
-    subject = fields.Char(string="Subject", compute="_extract_hs_fields", store=True)
-    content = fields.Char(string="Content", compute="_extract_hs_fields", store=True)
-    hubspot_owner_id = fields.Char(string="Owner", compute="_extract_hs_fields", store=True)
-    createdate = fields.Char(string="Date created", compute="_extract_hs_fields", store=True)
-    hs_pipeline = fields.Char(string="HS Pipeline", compute="_extract_hs_fields", store=True)
-    hs_pipeline_stage = fields.Char(string="HS Pipeline Stage", compute="_extract_hs_fields", store=True)
-    hs_ticket_id = fields.Char(string="HS Ticket ID", compute="_extract_hs_fields", store=True)
+    subject = fields.Char(string="Subject", readonly=True)
+    content = fields.Char(string="Content", readonly=True)
+    hubspot_owner_id = fields.Char(string="Owner", readonly=True)
+    createdate = fields.Datetime(string="Date created", readonly=True, index=True)
+    hs_pipeline = fields.Char(string="HS Pipeline", readonly=True)
+    hs_pipeline_stage = fields.Char(string="HS Pipeline Stage", readonly=True)
+    hs_ticket_id = fields.Char(string="HS Ticket ID", readonly=True)
 
     # Sales fields
-    so_number = fields.Char(string="SO/PO Number", compute="_extract_hs_fields", store=True)
-    quote_value____ = fields.Char(string="Quote Value", compute="_extract_hs_fields", store=True)
+    so_number = fields.Char(string="SO/PO Number", readonly=True)
+    quote_value____ = fields.Char(string="Quote Value", readonly=True)
 
     # Service fields
-    technician = fields.Char(string="Technician", compute="_extract_hs_fields", store=True)
-    other_techs = fields.Char(string="Other Techs", compute="_extract_hs_fields", store=True)
-    under_contract = fields.Char(string="Under Contract", compute="_extract_hs_fields", store=True)
-    recently_serviced = fields.Char(string="Recently Serviced", compute="_extract_hs_fields", store=True)
-    planned_hours = fields.Char(string="Planned Hours", compute="_extract_hs_fields", store=True)
-    planned_service_date = fields.Char(string="Planned Service Date", compute="_extract_hs_fields", store=True)
-    operational_impact = fields.Char(string="Operational Impact", compute="_extract_hs_fields", store=True)
+    technician = fields.Char(string="Technician", readonly=True)
+    other_techs = fields.Char(string="Other Techs", readonly=True)
+    under_contract = fields.Char(string="Under Contract", readonly=True)
+    recently_serviced = fields.Char(string="Recently Serviced", readonly=True)
+    planned_hours = fields.Char(string="Planned Hours", readonly=True)
+    planned_service_date = fields.Char(string="Planned Service Date", readonly=True)
+    operational_impact = fields.Char(string="Operational Impact", readonly=True)
 
     # Associations
     associated_contacts = fields.Many2many("durpro_hubspot_import.hubspot_contact",
@@ -52,40 +59,55 @@ class HubSpotTicket(models.Model):
                                      store=True)
 
     user_id = fields.Many2one("res.users", compute="_compute_owner", store=True)
+    helpdesk_ticket_ids = fields.One2many("helpdesk.ticket", "hubspot_ticket_id", string="Helpdesk Tickets")
 
     @api.model
-    def import_associated_contacts(self, next_offset: int) -> int:
-        return self.import_associations('ticket', 'contact', 'associated_contacts', next_offset)
+    def import_associated_contacts(self, last_id: int = 0) -> int:
+        return self.import_associations('ticket', 'contact', 'associated_contacts', last_id)
 
     @api.model
-    def import_associated_companies(self, next_offset: int) -> int:
-        return self.import_associations('ticket', 'company', 'associated_companies', next_offset)
+    def import_associated_companies(self, last_id: int = 0) -> int:
+        return self.import_associations('ticket', 'company', 'associated_companies', last_id)
 
     @api.model
-    def import_associated_emails(self, next_offset: int) -> int:
-        return self.import_associations('ticket', 'email', 'associated_emails', next_offset)
+    def import_associated_emails(self, last_id: int = 0) -> int:
+        return self.import_associations('ticket', 'email', 'associated_emails', last_id)
 
     @api.model
-    def import_associated_notes(self, next_offset: int) -> int:
-        return self.import_associations('ticket', 'note', 'associated_notes', next_offset)
+    def import_associated_notes(self, last_id: int = 0) -> int:
+        return self.import_associations('ticket', 'note', 'associated_notes', last_id)
+
+    def _get_helpdesk_ticket_vals(self) -> dict:
+        """The values of the helpdesk ticket converted from this HubSpot ticket that follow the HubSpot ticket, on
+        conversion as well as on incremental syncs."""
+        self.ensure_one()
+        return {
+            'name': self.subject or self.content or "No Subject",
+            'team_id': self.pipeline.helpdesk_team_id.id,
+            'stage_id': self.pipeline_stage.helpdesk_stage.id,
+            'user_id': self.user_id.id if self.user_id else False,
+        }
 
     @api.depends("hs_pipeline", "hs_pipeline_stage")
     def _compute_pipeline(self):
+        pipelines = self.env['durpro_hubspot_import.hubspot_pipeline'].search(
+            [('hs_pipeline_id', 'in', list(set(self.mapped('hs_pipeline'))))])
+        pipelines_dict = {p.hs_pipeline_id: p for p in pipelines}
+        stages = self.env['durpro_hubspot_import.hubspot_pipeline_stage'].search(
+            [('hs_stage_id', 'in', list(set(self.mapped('hs_pipeline_stage'))))])
+        # Stage ids are looked up within the ticket's pipeline first
+        stages_dict = {}
+        for stage in stages:
+            stages_dict[(stage.hs_pipeline_id.id, stage.hs_stage_id)] = stage
+            stages_dict.setdefault(stage.hs_stage_id, stage)
         for rec in self:
-            if rec.hs_pipeline:
-                pl = self.env['durpro_hubspot_import.hubspot_pipeline'].search(
-                    [('hs_pipeline_id', '=', rec.hs_pipeline)], limit=1)
-                if pl:
-                    rec.pipeline = pl[0]
-                else:
-                    print(f"Failed to link pipeline to ticket {rec.hs_ticket_id}")
-            if rec.hs_pipeline_stage:
-                pls = self.env['durpro_hubspot_import.hubspot_pipeline_stage'].search(
-                    [('hs_stage_id', '=', rec.hs_pipeline_stage)])
-                if pls:
-                    rec.pipeline_stage = pls[0]
-                else:
-                    print(f"Failed to link pipeline stage to ticket {rec.hs_ticket_id}")
+            rec.pipeline = pipelines_dict.get(rec.hs_pipeline, False)
+            if rec.hs_pipeline and not rec.pipeline:
+                _logger.warning(f"Failed to link pipeline to ticket {rec.hs_ticket_id}")
+            rec.pipeline_stage = stages_dict.get((rec.pipeline.id, rec.hs_pipeline_stage),
+                                                 stages_dict.get(rec.hs_pipeline_stage, False))
+            if rec.hs_pipeline_stage and not rec.pipeline_stage:
+                _logger.warning(f"Failed to link pipeline stage to ticket {rec.hs_ticket_id}")
 
     @api.depends('hubspot_owner_id')
     def _compute_owner(self):
@@ -104,4 +126,4 @@ class HelpdeskTicket(models.Model):
     _inherit = "helpdesk.ticket"
 
     hubspot_ticket_id = fields.Many2one("durpro_hubspot_import.hubspot_ticket", string="Original Hubspot Ticket",
-                                        help="The HubSpot ticket that this ticket was created from.", )
+                                        help="The HubSpot ticket that this ticket was created from.", index=True)
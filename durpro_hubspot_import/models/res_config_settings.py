@@ -1,5 +1,6 @@
 from odoo import models, fields, api, _
 from .. import constants
+from ..client_pool import invalidate_clients
 
 
 class ResConfigSettings(models.TransientModel):
@@ -20,6 +21,11 @@ class ResConfigSettings(models.TransientModel):
     )
     hubspot_auto_import = fields.Boolean(string="Automatic Import",
                                          help="Import HubSpot tickets and associated objects automatically.")
+    hubspot_incremental_sync = fields.Boolean(string="Incremental Sync",
+                                              help="Once the initial import is done, keep fetching the tickets, "
+                                                   "contacts, companies, notes and emails changed in HubSpot and "
+                                                   "update the helpdesk tickets accordingly.",
+                                              config_parameter=constants.HS_INCREMENTAL_SYNC_PARAM)
 
     hubspot_auto_import_controller = fields.Many2one("durpro_hubspot_import.auto_importer",
                                                      string="Auto Import Controller",
@@ -48,6 +54,8 @@ class ResConfigSettings(models.TransientModel):
     @api.depends('hubspot_auto_import_controller')
     def set_values(self):
         res = super(ResConfigSettings, self).set_values()
+        if self.app_key != self.env['ir.config_parameter'].sudo().get_param(constants.APPKEY_PARAM):
+            invalidate_clients()
         self.env['ir.config_parameter'].set_param(constants.APPKEY_PARAM, self.app_key)
         self.env['ir.config_parameter'].set_param(constants.PAGE_SIZE_PARAM, self.ticket_page_size)
         self.env['ir.config_parameter'].set_param(constants.HS_AUTO_IMPORT_PARAM, self.hubspot_auto_import)
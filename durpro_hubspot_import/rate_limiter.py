@@ -0,0 +1,168 @@
+from . import constants
+from . import metrics
+from datetime import datetime, timezone
+from hubspot.discovery.discovery_base import DiscoveryBase
+import functools
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class DailyLimitReached(Exception):
+    """Raised when the HubSpot daily API call limit is exhausted. Imports should stop and resume on a later run."""
+
+
+class RateLimiter:
+    """Token bucket rate limiter shared by every HubSpot API caller of the worker process.
+
+    Tokens are refilled continuously at per_second tokens per second, up to a burst of per_second tokens, so callers
+    never wait longer than needed for the next free slot. Calls are also counted against per_day, and the bucket is
+    kept in sync with the X-HubSpot-RateLimit-* headers returned by the API when they are present.
+
+    The import scheduled actions may run in different Odoo processes, each with its own limiter, so set_share() divides
+    the per-second budget by the number of them to keep their combined rate within the HubSpot limit.
+
+    Counters (calls made, 429 retries and seconds spent waiting for a token) are exposed for instrumentation via
+    stats()."""
+
+    def __init__(self, per_second: int, per_day: int, max_retries: int = 5):
+        self.total_per_second = per_second
+        self.per_second = per_second
+        self.per_day = per_day
+        self.max_retries = max_retries
+        self.calls = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+        self._tokens = float(per_second)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._day = self._today()
+        self._day_calls = 0
+
+    def set_share(self, shares: int):
+        """Limits this limiter to 1/shares of the per-second budget, e.g. when shares scheduled actions may be calling
+        HubSpot at the same time from as many processes."""
+        with self._lock:
+            self.per_second = self.total_per_second / max(shares, 1)
+            self._tokens = min(self._tokens, float(self.per_second))
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).date()
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.per_second), self._tokens + (now - self._refilled_at) * self.per_second)
+        self._refilled_at = now
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._day_calls = 0
+
+    def acquire(self):
+        """Blocks until a call can be made within the per-second limit and takes a token for it.
+
+        :raise DailyLimitReached: if the daily limit is exhausted.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._day_calls >= self.per_day:
+                    raise DailyLimitReached(f"HubSpot daily limit of {self.per_day} API calls reached.")
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._day_calls += 1
+                    self.calls += 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.per_second)
+            time.sleep(wait)
+            metrics.add('throttled_seconds', wait)
+            with self._lock:
+                self.throttled_seconds += wait
+
+    def back_off(self, seconds: float):
+        """Makes every caller wait for at least the given number of seconds, e.g. after a 429 response."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = min(self._tokens, 0.0)
+
+    def sync(self, headers):
+        """Aligns the limiter with the remaining call counts reported by HubSpot in the response headers."""
+        if not headers:
+            return
+        remaining = headers.get('X-HubSpot-RateLimit-Remaining')
+        daily_remaining = headers.get('X-HubSpot-RateLimit-Daily-Remaining')
+        with self._lock:
+            if remaining is not None and remaining.isdigit():
+                self._tokens = min(self._tokens, float(remaining))
+            if daily_remaining is not None and daily_remaining.isdigit():
+                self._day_calls = max(self._day_calls, self.per_day - int(daily_remaining))
+
+    def call(self, func, *args, **kwargs):
+        """Calls func once a token is available, retrying with backoff when HubSpot answers 429 Too Many Requests.
+
+        :return: The return value of func.
+        :raise DailyLimitReached: if the daily limit is exhausted, locally or according to HubSpot.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if getattr(e, 'status', None) != 429:
+                    raise
+                if 'DAILY' in str(getattr(e, 'body', '') or ''):
+                    with self._lock:
+                        self._day_calls = self.per_day
+                    raise DailyLimitReached("HubSpot reports that the daily API call limit is reached.") from e
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_after(e, attempt)
+                _logger.info(f"HubSpot rate limit hit, retrying in {delay} seconds.")
+                self.retries += 1
+                metrics.add('api_retries')
+                attempt += 1
+                self.back_off(delay)
+
+    @staticmethod
+    def _retry_after(exception, attempt: int) -> float:
+        headers = getattr(exception, 'headers', None) or {}
+        retry_after = headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return float(2 ** attempt)
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'throttled_seconds': self.throttled_seconds,
+        }
+
+
+hubspot_rate_limiter = RateLimiter(constants.HS_CALLS_PER_SECOND, constants.HS_CALLS_PER_DAY)
+# The CRM search endpoints have a lower limit of their own, on top of the general one.
+hubspot_search_rate_limiter = RateLimiter(constants.HS_SEARCH_CALLS_PER_SECOND, constants.HS_CALLS_PER_DAY)
+
+
+def rate_limited_api_factory(api_client_package, api_name, config):
+    """api_factory for the HubSpot client that sends every HTTP request of the generated API through
+    hubspot_rate_limiter."""
+    api = DiscoveryBase._default_api_factory(api_client_package, api_name, config)
+    api.api_client.request = functools.partial(_rate_limited_request, api.api_client.request)
+    return api
+
+
+def _rate_limited_request(request, *args, **kwargs):
+    metrics.add('api_calls')
+    response = hubspot_rate_limiter.call(request, *args, **kwargs)
+    if hasattr(response, 'getheaders'):
+        hubspot_rate_limiter.sync(response.getheaders())
+    return response
@@ -0,0 +1,73 @@
+from . import constants
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from lxml import etree
+from odoo.tools import html_sanitize, plaintext2html
+import logging
+import multiprocessing
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# One pool of sanitizing processes per worker process, started on first use
+_pool = None
+_pool_lock = threading.Lock()
+
+# Run in the pool processes before anything else. They are spawned rather than forked from the (threaded) Odoo worker,
+# so they start from a fresh interpreter that has to be told where the addons are to unpickle sanitize_email_body.
+_BOOTSTRAP = "import odoo.addons\nodoo.addons.__path__[:] = %r"
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import odoo.addons
+            _pool = ProcessPoolExecutor(max_workers=constants.HTML_SANITIZE_PROCESSES,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=exec, initargs=(_BOOTSTRAP % list(odoo.addons.__path__), {}))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Forgets a broken pool, so that the next call to get_pool starts a new one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def sanitize_email_bodies(htmls: list, texts: list, options: dict) -> list:
+    """The sanitized bodies of HubSpot emails (see sanitize_email_body), computed in parallel by the pool processes.
+    If the pool can't be used, for example because one of its processes died, the bodies are sanitized in this process
+    instead and the pool is started again on the next call.
+
+    :param htmls: The HTML versions of the emails.
+    :param texts: The text versions of the emails, in the same order.
+    :param options: The html_sanitize options of the field the bodies are stored in.
+    """
+    pool = get_pool()
+    try:
+        return list(pool.map(sanitize_email_body, htmls, texts, repeat(options), chunksize=10))
+    except (BrokenProcessPool, OSError):
+        _logger.warning("The HTML sanitizing processes can't be used, sanitizing in this process.", exc_info=True)
+        _discard_pool(pool)
+    return [sanitize_email_body(html, text, options) for html, text in zip(htmls, texts)]
+
+
+def sanitize_email_body(html: str, text: str, options: dict) -> str:
+    """The sanitized chatter message body of a HubSpot email: its HTML version if it can be parsed, otherwise its text
+    version. Runs in the pool processes, so it only takes and returns plain values.
+
+    :param options: The html_sanitize options of the field the body is stored in.
+    """
+    body = html or plaintext2html(text) or plaintext2html("")
+    tree = etree.fromstring(body, parser=etree.HTMLParser())
+    if tree is None:
+        body = plaintext2html(text) or plaintext2html("")
+        tree = etree.fromstring(body, parser=etree.HTMLParser())
+        if tree is None:
+            body = ""
+    return str(html_sanitize(body, silent=True, **options))